@@ -1,15 +1,55 @@
 """AstrBot Stable Diffusion 插件包"""
 
+from .persistence import DebouncedWriter
+from .config_snapshot import ConfigSnapshot
 from .config_manager import ConfigManager
+from .cache_utils import TTLCache
+from .tracing import Span, Trace, Tracer
+from .metrics import Metrics, MetricsExporter
+from .backend_pool import Backend, BackendCall, BackendPool
+from .stream_decoder import ImagesStreamParser
+from .image_record import ImageRecord
+from .image_encoder import ImageEncoder
+from .image_spool import ImageSpool
+from .progress_watcher import ProgressWatcher
 from .api_client import SDWebUIClient
+from .scheduler import FairScheduler, Ticket
+from .adaptive_limiter import AdaptiveLimiter
+from .result_cache import ResultCache
+from .presets import PresetStore
+from .jobs import GenerationJob, JobRegistry, SharedGeneration
 from .resource_manager import ResourceManager
 from .image_processor import ImageProcessor
 from .command_handlers import CommandHandlers
 from .llm_tools import LLMTools
 
 __all__ = [
+    "DebouncedWriter",
+    "ConfigSnapshot",
     "ConfigManager",
+    "TTLCache",
+    "Span",
+    "Trace",
+    "Tracer",
+    "Metrics",
+    "MetricsExporter",
+    "Backend",
+    "BackendCall",
+    "BackendPool",
+    "ImagesStreamParser",
+    "ImageRecord",
+    "ImageEncoder",
+    "ImageSpool",
+    "ProgressWatcher",
     "SDWebUIClient",
+    "FairScheduler",
+    "Ticket",
+    "AdaptiveLimiter",
+    "ResultCache",
+    "PresetStore",
+    "GenerationJob",
+    "JobRegistry",
+    "SharedGeneration",
     "ResourceManager",
     "ImageProcessor",
     "CommandHandlers",
@@ -0,0 +1,229 @@
+"""自适应限流模块，根据后端的延迟、错误与显存占用以 AIMD 方式调整并发生成数"""
+
+import asyncio
+import logging
+import statistics
+import time
+
+logger = logging.getLogger(__name__)
+
+# 调整并发数的间隔（秒）
+ADJUST_INTERVAL = 10
+# 单位工作量耗时超过基线的倍数时视为过载
+LATENCY_TOLERANCE = 2.0
+# 周期内错误率超过此值时视为过载（至少需要 MIN_ERROR_SAMPLES 个样本）
+ERROR_RATE_LIMIT = 0.2
+MIN_ERROR_SAMPLES = 3
+# 过载时与显存不足时的乘性减小系数
+BACKOFF = 0.75
+OOM_BACKOFF = 0.5
+# 耗时基线每个周期向上漂移的比例，使基线能跟随负载的变化上升
+BASELINE_DRIFT = 1.02
+# 一个单位工作量：512x512 分辨率的一个采样步骤
+WORK_UNIT_PIXELS = 512 * 512
+
+
+def work_units(payload: dict) -> float:
+    """估算生成请求的工作量（图像数 × 采样步数 × 分辨率）"""
+    images = (payload.get("batch_size") or 1) * (payload.get("n_iter") or 1)
+    pixels = (payload.get("width") or 512) * (payload.get("height") or 512)
+    return max(1.0, images * (payload.get("steps") or 20) * pixels / WORK_UNIT_PIXELS)
+
+
+def is_oom_error(error: BaseException) -> bool:
+    """判断后端返回的错误是否为显存不足"""
+    text = str(error).lower()
+    return "out of memory" in text or "outofmemoryerror" in text
+
+
+class AdaptiveLimiter:
+    """自适应限流器
+
+    以 AIMD（加性增、乘性减）方式调整公平调度器的并发槽位数，范围为
+    min_concurrent_tasks ~ max_concurrent_tasks，从下限开始：
+
+    - 显存不足（生成请求报 OOM，或 /sdapi/v1/memory 报告的 OOM 次数增加）时减半；
+    - 显存占用率超过上限、周期内错误率过高，或单位工作量的耗时超过基线的 LATENCY_TOLERANCE 倍时减小到 3/4；
+    - 没有上述压力、周期内有成功的生成且槽位占满仍有排队时增加：首次出现压力前成倍增加，之后每周期加一。
+
+    WebUI 按顺序处理请求，分配到同一后端的请求越多，每个请求的耗时越长，
+    因此耗时相对基线的增长反映了后端上的排队。基线为观测到的最小单位工作量耗时，
+    切换模型后重新测量。每次减小后至少等待一个周期再调整，以观察调整的效果。
+    """
+
+    def __init__(self, api_client, config_manager, scheduler):
+        self.api_client = api_client
+        self.config_manager = config_manager
+        self.scheduler = scheduler
+        self.metrics = api_client.metrics
+        self.min_limit = config_manager.get_min_concurrent_tasks()
+        self.max_limit = config_manager.get_max_concurrent_tasks()
+        self.limit = self.min_limit
+        # 首次出现压力前处于慢启动阶段，成倍增加并发数
+        self.slow_start = True
+        # 单位工作量耗时的基线（秒），及测量基线时的模型
+        self.baseline = None
+        self.baseline_model = scheduler.current_model
+        self.last_reason = ""
+        self._last_decrease = 0.0
+        # 当前周期的观测：单位工作量耗时、成功与失败次数、是否出现槽位占满且有排队
+        self._latencies = []
+        self._successes = 0
+        self._errors = 0
+        self._saturated = False
+        # 后端地址 -> WebUI 报告的累计 OOM 次数
+        self._oom_events = {}
+        self._task = None
+        scheduler.set_capacity(self.limit)
+        self.metrics.gauge("concurrency_limit", lambda: self.limit, "并发上限")
+
+    def set_bounds(self, min_limit: int, max_limit: int):
+        """设置并发数的范围，当前并发数超出范围时立即调整"""
+        self.max_limit = max(1, max_limit)
+        self.min_limit = min(max(1, min_limit), self.max_limit)
+        self._set_limit(min(max(self.limit, self.min_limit), self.max_limit), "并发范围变化")
+
+    def start(self):
+        """启动后台调整任务（需在事件循环中调用，重复调用无副作用）"""
+        if self._task and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        """停止后台调整任务"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        """按固定间隔循环调整并发数"""
+        while True:
+            await asyncio.sleep(ADJUST_INTERVAL)
+            try:
+                await self.adjust()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"调整并发数异常: {e}")
+
+    def record(self, payload: dict, duration: float, error: BaseException = None):
+        """记录一次生成请求的结果，显存不足时立即减小并发数"""
+        self._saturated = self._saturated or self._is_saturated()
+        if error is None:
+            self._successes += 1
+            self._latencies.append(duration / work_units(payload))
+            return
+
+        self._errors += 1
+        if is_oom_error(error):
+            self.metrics.inc("oom_total")
+            self._decrease(OOM_BACKOFF, "生成时显存不足")
+
+    async def adjust(self):
+        """执行一个调整周期"""
+        if self.scheduler.current_model != self.baseline_model:
+            # 不同模型的生成速度不同，切换模型后重新测量基线
+            self.baseline = None
+            self.baseline_model = self.scheduler.current_model
+
+        saturated = self._saturated or self._is_saturated()
+        reason = await self._check_vram() or self._check_errors() or self._check_latency()
+        if reason:
+            self._decrease(BACKOFF, reason)
+        elif saturated and self._successes and time.monotonic() - self._last_decrease >= ADJUST_INTERVAL:
+            self._increase()
+
+        self._latencies = []
+        self._successes = 0
+        self._errors = 0
+        self._saturated = False
+
+    def _is_saturated(self) -> bool:
+        """槽位已占满且仍有任务排队"""
+        return self.scheduler.queued > 0 and self.scheduler.running >= self.scheduler.capacity
+
+    async def _check_vram(self) -> str:
+        """查询各后端的显存占用，返回压力原因，没有压力时返回空字符串
+
+        PyTorch 会缓存释放的显存，系统层面的占用率在空闲时也很高，
+        因此优先使用张量实际占用（active）的显存计算占用率。
+        """
+        watermark = self.config_manager.get_vram_high_watermark()
+        for backend in self.api_client.pool.backends:
+            if not backend.healthy:
+                continue
+            try:
+                data = await self.api_client.get_memory(backend)
+            except ConnectionError as e:
+                logger.debug(f"查询 {backend.url} 的显存占用失败: {e}")
+                continue
+
+            cuda = data.get("cuda") or {}
+            oom = (cuda.get("events") or {}).get("oom")
+            if oom is not None:
+                previous = self._oom_events.get(backend.url)
+                self._oom_events[backend.url] = oom
+                if previous is not None and oom > previous:
+                    self.metrics.inc("oom_total", oom - previous)
+                    self._decrease(OOM_BACKOFF, f"{backend.url} 显存不足")
+                    return f"{backend.url} 显存不足"
+
+            total = (cuda.get("system") or {}).get("total")
+            used = (cuda.get("active") or {}).get("current")
+            if used is None:
+                used = (cuda.get("system") or {}).get("used")
+            if total and used is not None and used / total > watermark:
+                return f"{backend.url} 显存占用率 {used / total:.0%}"
+        return ""
+
+    def _check_errors(self) -> str:
+        """检查周期内的错误率"""
+        total = self._successes + self._errors
+        if total < MIN_ERROR_SAMPLES or self._errors / total <= ERROR_RATE_LIMIT:
+            return ""
+        return f"错误率 {self._errors / total:.0%}"
+
+    def _check_latency(self) -> str:
+        """比较周期内单位工作量耗时的中位数与基线，并更新基线"""
+        if not self._latencies:
+            return ""
+        current = statistics.median(self._latencies)
+        if self.baseline is None or current < self.baseline:
+            self.baseline = current
+            return ""
+        ratio = current / self.baseline
+        self.baseline *= BASELINE_DRIFT
+        if ratio > LATENCY_TOLERANCE:
+            return f"耗时为基线的 {ratio:.1f} 倍"
+        return ""
+
+    def _increase(self):
+        limit = self.limit * 2 if self.slow_start else self.limit + 1
+        self._set_limit(min(limit, self.max_limit), "无压力且有任务排队")
+
+    def _decrease(self, factor: float, reason: str):
+        """乘性减小并发数；同一周期内只减小一次"""
+        now = time.monotonic()
+        if now - self._last_decrease < ADJUST_INTERVAL:
+            return
+        self._last_decrease = now
+        self.slow_start = False
+        self._set_limit(max(self.min_limit, int(self.limit * factor)), reason)
+
+    def _set_limit(self, limit: int, reason: str):
+        if limit == self.limit:
+            return
+        direction = "up" if limit > self.limit else "down"
+        logger.info(f"并发数 {self.limit} -> {limit}（{reason}）")
+        self.metrics.inc("concurrency_adjustments_total", direction=direction)
+        self.limit = limit
+        self.last_reason = reason
+        self.scheduler.set_capacity(limit)
@@ -2,20 +2,46 @@
 
 import asyncio
 import base64
+import contextlib
 import logging
+import time
 
 import aiohttp
 
+from .backend_pool import BackendCall, BackendPool
+from .config_snapshot import ConfigSnapshot
+from .health_monitor import HealthMonitor
+from .image_record import ImageRecord
+from .metrics import Metrics
+from .stream_decoder import ImagesStreamParser
+from .tracing import span
+
 logger = logging.getLogger(__name__)
 
+# 流式读取响应时每次读取的块大小
+STREAM_CHUNK_SIZE = 256 * 1024
+
 
 class SDWebUIClient:
     """Stable Diffusion WebUI API客户端"""
 
-    def __init__(self, config_manager):
+    def __init__(self, config_manager, metrics: Metrics = None):
         self.config_manager = config_manager
+        self.metrics = metrics if metrics is not None else Metrics()
         self.session = None
         self._lock = asyncio.Lock()
+        self.pool = BackendPool(
+            config_manager.get_webui_urls(),
+            failure_threshold=config_manager.get_health_failure_threshold(),
+            circuit_cooldown=config_manager.get_health_circuit_cooldown()
+        )
+        self.health_monitor = HealthMonitor(self, config_manager)
+        # 各后端当前加载的模型（通过本插件设置的）
+        self.current_model = config_manager.get_base_model()
+        self._model_lock = asyncio.Lock()
+        # 超时或取消后中断后端生成的次数，以及估算回收的GPU时间（秒）
+        self.interrupt_count = 0
+        self.reclaimed_gpu_seconds = 0.0
 
     async def ensure_session(self):
         """确保会话连接"""
@@ -25,87 +51,255 @@ class SDWebUIClient:
                 self.session = aiohttp.ClientSession(
                     timeout=aiohttp.ClientTimeout(timeout)
                 )
+        self.health_monitor.start()
 
     async def close_session(self):
         """关闭会话"""
+        await self.health_monitor.stop()
         if self.session and not self.session.closed:
             await self.session.close()
 
     async def _call_api(self, endpoint: str, payload: dict) -> dict:
-        """通用API调用函数"""
+        """通用API调用函数，请求会被路由到负载最低的后端"""
+        await self.ensure_session()
+        call = BackendCall()
+        async with self.pool.acquire(call) as backend:
+            self.metrics.inc("backend_requests_total", backend=backend.url)
+            try:
+                url = f"{backend.url}{endpoint}"
+                with span("backend_request", backend=backend.url, endpoint=endpoint), \
+                        self.metrics.timer("backend_request_seconds", backend=backend.url, endpoint=endpoint):
+                    async with self.session.post(url, json=payload) as resp:
+                        if resp.status != 200:
+                            self.metrics.inc("backend_errors_total", backend=backend.url, reason=f"http_{resp.status}")
+                            if resp.status >= 500:
+                                # 5xx 表示后端自身异常（崩溃、显存不足等），计入熔断；4xx 是请求参数问题
+                                self.pool.mark_failure(backend, resp.status)
+                            error = await resp.text()
+                            raise ConnectionError(f"API错误 ({resp.status}): {error}")
+                        body = await resp.read()
+                        self.metrics.inc("backend_bytes_total", len(body), backend=backend.url)
+                        result = await resp.json()
+                self.pool.mark_success(backend)
+                return result
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.metrics.inc("backend_errors_total", backend=backend.url, reason="timeout")
+                await self._reclaim(call)
+                raise
+            except aiohttp.ClientError as e:
+                self.metrics.inc("backend_errors_total", backend=backend.url, reason="connection")
+                self.pool.mark_failure(backend)
+                raise ConnectionError(f"连接失败: {str(e)}")
+
+    async def _stream_images(self, endpoint: str, payload: dict, call: BackendCall = None):
+        """流式调用返回 images 数组的API，每读取完一张图像就产出其base64字符串"""
         await self.ensure_session()
+        call = call if call is not None else BackendCall()
+        async with self.pool.acquire(call) as backend:
+            self.metrics.inc("backend_requests_total", backend=backend.url)
+            start = time.perf_counter()
+            try:
+                url = f"{backend.url}{endpoint}"
+                with span("backend_request", backend=backend.url, endpoint=endpoint):
+                    async with self.session.post(url, json=payload) as resp:
+                        if resp.status != 200:
+                            self.metrics.inc("backend_errors_total", backend=backend.url, reason=f"http_{resp.status}")
+                            if resp.status >= 500:
+                                # 5xx 表示后端自身异常（崩溃、显存不足等），计入熔断；4xx 是请求参数问题
+                                self.pool.mark_failure(backend, resp.status)
+                            error = await resp.text()
+                            raise ConnectionError(f"API错误 ({resp.status}): {error}")
+                        parser = ImagesStreamParser()
+                        async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                            self.metrics.inc("backend_bytes_total", len(chunk), backend=backend.url)
+                            for image in parser.feed(chunk):
+                                yield image.decode("ascii")
+                self.pool.mark_success(backend)
+                self.metrics.observe(
+                    "backend_request_seconds", time.perf_counter() - start, backend=backend.url, endpoint=endpoint
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.metrics.inc("backend_errors_total", backend=backend.url, reason="timeout")
+                await self._reclaim(call)
+                raise
+            except aiohttp.ClientError as e:
+                self.metrics.inc("backend_errors_total", backend=backend.url, reason="connection")
+                self.pool.mark_failure(backend)
+                raise ConnectionError(f"连接失败: {str(e)}")
+
+    async def _reclaim(self, call: BackendCall):
+        """请求超时或被取消时中断后端上仍在执行的生成，避免GPU继续处理被放弃的任务
+
+        WebUI 按顺序处理请求，只有当本次调用是该后端上最早的进行中调用时才是正在执行的任务，
+        此时才会中断；否则中断的会是其他请求。中断前通过进度接口估算回收的GPU时间。
+        """
+        backend = call.backend
+        if not self.pool.is_running(call):
+            logger.info(f"被放弃的请求尚未在 {backend.url} 上开始执行，不发送中断")
+            return
+
+        remaining = 0.0
         try:
-            url = f"{self.config_manager.get_webui_url()}{endpoint}"
-            async with self.session.post(url, json=payload) as resp:
-                if resp.status != 200:
-                    error = await resp.text()
-                    raise ConnectionError(f"API错误 ({resp.status}): {error}")
-                return await resp.json()
-        except aiohttp.ClientError as e:
-            raise ConnectionError(f"连接失败: {str(e)}")
+            data = await self.get_progress(backend)
+            if data.get("state", {}).get("job_count", 1):
+                remaining = data.get("eta_relative") or 0.0
+        except ConnectionError as e:
+            logger.debug(f"查询生成进度失败: {e}")
 
-    async def check_availability(self) -> tuple[bool, int]:
-        """检查服务可用性"""
+        if await self.interrupt(backend):
+            self.interrupt_count += 1
+            self.reclaimed_gpu_seconds += remaining
+            logger.info(f"已中断 {backend.url} 上被放弃的生成，约回收GPU时间 {remaining:.1f} 秒")
+
+    async def interrupt(self, backend) -> bool:
+        """中断指定后端上正在执行的生成"""
         try:
             await self.ensure_session()
-            url = f"{self.config_manager.get_webui_url()}/sdapi/v1/txt2img"
+            async with self.session.post(f"{backend.url}/sdapi/v1/interrupt") as resp:
+                if resp.status == 200:
+                    logger.info(f"已中断 {backend.url} 上的生成任务")
+                    return True
+                logger.warning(f"中断 {backend.url} 上的生成任务失败 (状态码: {resp.status})")
+        except Exception as e:
+            logger.warning(f"中断 {backend.url} 上的生成任务异常: {e}")
+        return False
+
+    async def check_backend(self, backend) -> tuple[bool, int]:
+        """检查单个后端的可用性"""
+        try:
+            url = f"{backend.url}/sdapi/v1/txt2img"
             async with self.session.get(url) as resp:
                 if resp.status == 200 or resp.status == 405:
                     return True, 0
                 else:
-                    logger.debug(f"⚠️ Stable diffusion Webui 返回值异常，状态码: {resp.status})")
+                    logger.debug(f"⚠️ Stable diffusion Webui {backend.url} 返回值异常，状态码: {resp.status})")
                     return False, resp.status
+        except Exception as e:
+            logger.debug(f"❌ 测试连接 Stable diffusion Webui {backend.url} 失败，报错：{e}")
+            return False, 0
+
+    async def check_availability(self) -> tuple[bool, int]:
+        """立即探测所有后端并刷新缓存的健康状态，任一后端可用即视为可用"""
+        try:
+            await self.health_monitor.probe_all()
         except Exception as e:
             logger.debug(f"❌ 测试连接 Stable diffusion Webui 失败，报错：{e}")
             return False, 0
 
-    async def generate_text_to_image(self, prompt: str) -> dict:
-        """调用文本到图像生成API"""
-        payload = self._build_generation_payload(prompt)
-        return await self._call_api("/sdapi/v1/txt2img", payload)
-
-    async def process_image_upscale(self, image_base64: str) -> str:
-        """处理图像超分辨率放大"""
-        params = self.config_manager.get_default_params()
-        upscale_factor = params["upscale_factor"] or "2"
-        upscaler = params["upscaler"] or "未设置"
-
-        payload = {
-            "image": image_base64,
-            "upscaling_resize": upscale_factor,
-            "upscaler_1": upscaler,
-            "resize_mode": 0,
-            "show_extras_results": True,
-            "upscaling_resize_w": 1,
-            "upscaling_resize_h": 1,
-            "upscaling_crop": False,
-            "gfpgan_visibility": 0,
-            "codeformer_visibility": 0,
-            "codeformer_weight": 0,
-            "extras_upscaler_2_visibility": 0
-        }
+        if self.pool.has_available():
+            return True, 0
+        return False, self.pool.backends[0].last_status
+
+    async def stream_text_to_image(self, payload: dict, call: BackendCall = None):
+        """流式调用文本到图像生成API，逐张产出图像记录"""
+        index = 0
+        async for image in self._stream_images("/sdapi/v1/txt2img", payload, call):
+            yield ImageRecord(base64_data=image, index=index)
+            index += 1
+
+    async def generate_text_to_image(self, payload: dict, call: BackendCall = None) -> list:
+        """调用文本到图像生成API，payload 由 build_generation_payload 构建
+
+        响应以流的方式解析，只保留图像数据，避免同时持有原始字节、文本与解析结果三份拷贝。
+        传入 call 时会记录处理本次请求的后端，以便查询进度。
+        """
+        return [record async for record in self.stream_text_to_image(payload, call)]
+
+    async def get_progress(self, backend, include_preview: bool = False) -> dict:
+        """查询指定后端当前任务的进度"""
+        await self.ensure_session()
+        url = f"{backend.url}/sdapi/v1/progress"
+        params = {"skip_current_image": "false" if include_preview else "true"}
+        try:
+            async with self.session.get(url, params=params) as resp:
+                if resp.status != 200:
+                    raise ConnectionError(f"API错误 ({resp.status})")
+                return await resp.json()
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f"连接失败: {str(e)}")
+
+    async def get_memory(self, backend) -> dict:
+        """查询指定后端的内存与显存占用"""
+        await self.ensure_session()
+        try:
+            async with self.session.get(f"{backend.url}/sdapi/v1/memory") as resp:
+                if resp.status != 200:
+                    raise ConnectionError(f"API错误 ({resp.status})")
+                return await resp.json()
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f"连接失败: {str(e)}")
+
+    async def process_image_upscale(self, record: ImageRecord, upscale_payload: dict = None) -> ImageRecord:
+        """处理图像超分辨率放大，upscale_payload 为配置快照构建的公共参数"""
+        payload = upscale_payload or self.config_manager.snapshot().build_upscale_payload()
+        payload = {**payload, "image": await record.read_base64()}
 
         resp = await self._call_api("/sdapi/v1/extra-single-image", payload)
-        return resp["image"]
+        return ImageRecord(base64_data=resp["image"], index=record.index, upscaled=True)
+
+    async def stream_batch_upscale(self, records: list, upscale_payload: dict = None):
+        """一次请求批量放大多张图像，按完成顺序逐张产出放大后的图像记录"""
+        payload = upscale_payload or self.config_manager.snapshot().build_upscale_payload()
+        payload = {**payload, "imageList": [
+            {"data": await record.read_base64(), "name": f"{record.index}.png"} for record in records
+        ]}
+
+        position = 0
+        # 提前结束迭代时立即关闭内部生成器，归还后端连接与并发计数
+        async with contextlib.aclosing(self._stream_images("/sdapi/v1/extra-batch-images", payload)) as images:
+            async for image in images:
+                if position >= len(records):
+                    break
+                yield ImageRecord(base64_data=image, index=records[position].index, upscaled=True)
+                position += 1
 
-    async def set_model(self, model_name: str) -> bool:
-        """设置模型"""
+    async def _set_backend_model(self, backend, model_name: str) -> bool:
+        """在单个后端上设置模型"""
         try:
-            await self.ensure_session()
-            url = f"{self.config_manager.get_webui_url()}/sdapi/v1/options"
+            url = f"{backend.url}/sdapi/v1/options"
             payload = {"sd_model_checkpoint": model_name}
 
             async with self.session.post(url, json=payload) as resp:
                 if resp.status == 200:
-                    logger.debug(f"模型已设置为: {model_name}")
+                    logger.debug(f"{backend.url} 模型已设置为: {model_name}")
                     return True
                 else:
-                    logger.error(f"设置模型失败 (状态码: {resp.status})")
+                    logger.error(f"{backend.url} 设置模型失败 (状态码: {resp.status})")
                     return False
+        except Exception as e:
+            logger.error(f"{backend.url} 设置模型异常: {e}")
+            return False
+
+    async def _switch_model(self, model_name: str) -> bool:
+        """在所有后端上设置模型，任一后端成功即视为成功（调用方需持有 _model_lock）"""
+        try:
+            await self.ensure_session()
         except Exception as e:
             logger.error(f"设置模型异常: {e}")
             return False
 
+        results = await asyncio.gather(*(self._set_backend_model(b, model_name) for b in self.pool.backends))
+        if any(results):
+            self.current_model = model_name
+            return True
+        return False
+
+    async def ensure_model(self, model_name: str) -> bool:
+        """确保后端已加载指定模型，仅在与当前模型不同时才切换
+
+        这是切换模型的唯一入口，只应在调度器分配槽位之后调用：调度器保证需要其他模型的任务
+        已全部结束（槽位已排空）才会分配需要新模型的任务，切换不会影响正在执行的生成。
+        """
+        if not model_name or model_name == self.current_model:
+            return True
+        async with self._model_lock:
+            if model_name == self.current_model:
+                return True
+            logger.info(f"切换模型: {self.current_model or '未知'} -> {model_name}")
+            return await self._switch_model(model_name)
+
     async def fetch_resources(self, resource_type: str) -> list:
         """从WebUI获取指定类型的资源列表"""
         endpoint_map = {
@@ -122,7 +316,7 @@ class SDWebUIClient:
 
         try:
             await self.ensure_session()
-            url = f"{self.config_manager.get_webui_url()}{endpoint_map[resource_type]}"
+            url = f"{self.pool.pick().url}{endpoint_map[resource_type]}"
             async with self.session.get(url) as resp:
                 if resp.status == 200:
                     resources = await resp.json()
@@ -153,18 +347,7 @@ class SDWebUIClient:
         else:
             return []
 
-    def _build_generation_payload(self, prompt: str) -> dict:
-        """构建图像生成参数"""
-        params = self.config_manager.get_default_params()
-
-        return {
-            "prompt": prompt,
-            "negative_prompt": self.config_manager.get_negative_prompt_global(),
-            "width": params["width"],
-            "height": params["height"],
-            "steps": params["steps"],
-            "sampler_name": params["sampler"],
-            "cfg_scale": params["cfg_scale"],
-            "batch_size": params["batch_size"],
-            "n_iter": params["n_iter"],
-        }
+    def build_generation_payload(self, prompt: str, config: ConfigSnapshot = None) -> dict:
+        """构建图像生成参数，未传入配置快照时使用当前配置"""
+        config = config or self.config_manager.snapshot()
+        return config.build_payload(prompt)
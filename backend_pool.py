@@ -0,0 +1,142 @@
+"""后端池模块，负责在多个WebUI实例之间分配请求"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+# 延迟的指数加权平均系数，越大越偏向最近一次的观测值
+LATENCY_EWMA_ALPHA = 0.3
+# 尚无延迟观测时使用的默认值（秒）
+DEFAULT_LATENCY = 1.0
+# 熔断器默认参数：连续失败次数阈值与熔断冷却时间（秒）
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_CIRCUIT_COOLDOWN = 30.0
+
+
+class Backend:
+    """单个WebUI后端的运行状态"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.latency = None
+        self.total_requests = 0
+        self.failures = 0
+        # 进行中的调用，按发起顺序排列；WebUI 按顺序处理请求，第一个即为正在执行的调用
+        self.calls = []
+        # 健康状态（由健康监测与请求结果共同维护）
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.circuit_open_until = 0.0
+        self.probe_latency = None
+        self.last_seen = None
+        self.last_status = 0
+
+    def circuit_open(self, now: float = None) -> bool:
+        """熔断器是否处于打开状态（冷却期内不再探测）"""
+        now = time.monotonic() if now is None else now
+        return not self.healthy and now < self.circuit_open_until
+
+    def observe_latency(self, elapsed: float):
+        """记录一次请求耗时，更新延迟的加权平均值"""
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = LATENCY_EWMA_ALPHA * elapsed + (1 - LATENCY_EWMA_ALPHA) * self.latency
+
+    def load_score(self, default_latency: float) -> float:
+        """计算负载分数：进行中的请求数（含本次）乘以观测延迟"""
+        latency = self.latency if self.latency is not None else default_latency
+        return (self.in_flight + 1) * latency
+
+
+class BackendCall:
+    """一次后端调用的跟踪信息，记录处理该调用的后端，用于查询进度或中断"""
+
+    def __init__(self):
+        self.backend = None
+        self.started_at = None
+
+    def bind(self, backend: Backend):
+        """记录处理本次调用的后端与开始时间"""
+        self.backend = backend
+        self.started_at = time.monotonic()
+
+
+class BackendPool:
+    """WebUI后端池，按最少进行中请求数（以延迟加权）选择后端"""
+
+    def __init__(self, urls: list, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 circuit_cooldown: float = DEFAULT_CIRCUIT_COOLDOWN):
+        if not urls:
+            raise ValueError("至少需要配置一个WebUI地址")
+        self.backends = [Backend(url) for url in urls]
+        self.failure_threshold = max(1, failure_threshold)
+        self.circuit_cooldown = circuit_cooldown
+        self.healthy_count = len(self.backends)
+
+    def has_available(self) -> bool:
+        """是否存在健康的后端"""
+        return self.healthy_count > 0
+
+    def mark_success(self, backend: Backend, probe_latency: float = None):
+        """记录后端可用，关闭熔断器"""
+        if not backend.healthy:
+            backend.healthy = True
+            self.healthy_count += 1
+        backend.consecutive_failures = 0
+        backend.circuit_open_until = 0.0
+        backend.last_seen = time.time()
+        backend.last_status = 0
+        if probe_latency is not None:
+            backend.probe_latency = probe_latency
+
+    def mark_failure(self, backend: Backend, status: int = 0):
+        """记录后端失败，连续失败达到阈值时打开熔断器"""
+        backend.consecutive_failures += 1
+        backend.last_status = status
+        if backend.consecutive_failures >= self.failure_threshold:
+            if backend.healthy:
+                backend.healthy = False
+                self.healthy_count -= 1
+            backend.circuit_open_until = time.monotonic() + self.circuit_cooldown
+
+    def _default_latency(self) -> float:
+        """已观测后端的平均延迟，用作未观测后端的估计值"""
+        observed = [b.latency for b in self.backends if b.latency is not None]
+        return sum(observed) / len(observed) if observed else DEFAULT_LATENCY
+
+    def pick(self) -> Backend:
+        """选择当前负载分数最低的后端，优先选择健康的后端"""
+        candidates = [b for b in self.backends if b.healthy] or self.backends
+        default_latency = self._default_latency()
+        return min(candidates, key=lambda b: (b.load_score(default_latency), b.in_flight))
+
+    def is_running(self, call: BackendCall) -> bool:
+        """调用是否为其后端上最早发起、即WebUI正在执行的调用"""
+        backend = call.backend
+        return backend is not None and bool(backend.calls) and backend.calls[0] is call
+
+    @asynccontextmanager
+    async def acquire(self, call: BackendCall = None):
+        """占用一个后端执行请求，成功时记录耗时；传入 call 时将其绑定到所选后端"""
+        backend = self.pick()
+        call = call if call is not None else BackendCall()
+        call.bind(backend)
+        backend.calls.append(call)
+        backend.in_flight += 1
+        backend.total_requests += 1
+        start = time.perf_counter()
+        try:
+            yield backend
+        except asyncio.CancelledError:
+            # 用户取消或合并请求的收尾不代表后端出错
+            raise
+        except Exception:
+            backend.failures += 1
+            raise
+        else:
+            backend.observe_latency(time.perf_counter() - start)
+        finally:
+            backend.in_flight -= 1
+            backend.calls.remove(call)
@@ -0,0 +1,140 @@
+"""模拟的 Stable Diffusion WebUI 服务，用于基准测试
+
+在进程内启动一个 aiohttp 服务，实现插件用到的 WebUI 接口。生成与放大的耗时、
+GPU 并行数和返回图像的大小均可配置，返回的图像是指定大小的随机数据（以PNG文件头开头），
+其 base64 长度与真实的 PNG 相当。
+"""
+
+import asyncio
+import base64
+import os
+import time
+
+from aiohttp import web
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 模拟的显存：总量、模型常驻占用与每个执行中请求的占用（字节）
+VRAM_TOTAL = 24 * 1024 ** 3
+VRAM_MODEL = 4 * 1024 ** 3
+VRAM_PER_JOB = 3 * 1024 ** 3
+
+
+class FakeWebUI:
+    """模拟的 WebUI 服务"""
+
+    def __init__(self, txt2img_latency: float = 1.0, upscale_latency: float = 0.3, image_kb: int = 1024,
+                 gpu_slots: int = 1, host: str = "127.0.0.1", port: int = 0):
+        self.txt2img_latency = txt2img_latency
+        self.upscale_latency = upscale_latency
+        self.host = host
+        self.port = port
+        # WebUI 按顺序处理请求，gpu_slots 个请求可以同时执行
+        self._gpu = asyncio.Semaphore(gpu_slots)
+        self._image = base64.b64encode(PNG_SIGNATURE + os.urandom(image_kb * 1024)).decode("ascii")
+        self._runner = None
+        self._running = {}  # 请求序号 -> (开始时间, 预计耗时)
+        self._next_id = 0
+        self.requests = 0
+        self.interrupts = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application(client_max_size=512 * 1024 * 1024)
+        app.router.add_post("/sdapi/v1/txt2img", self._txt2img)
+        app.router.add_post("/sdapi/v1/extra-single-image", self._extra_single)
+        app.router.add_post("/sdapi/v1/extra-batch-images", self._extra_batch)
+        app.router.add_get("/sdapi/v1/progress", self._progress)
+        app.router.add_post("/sdapi/v1/interrupt", self._interrupt)
+        app.router.add_post("/sdapi/v1/options", self._options)
+        app.router.add_get("/sdapi/v1/memory", self._memory)
+        for path, items in (
+            ("/sdapi/v1/sd-models", [{"title": "fake-model.safetensors", "model_name": "fake-model"}]),
+            ("/sdapi/v1/loras", [{"name": "fake-lora"}]),
+            ("/sdapi/v1/samplers", [{"name": "Euler a"}, {"name": "DPM++ 2M"}]),
+            ("/sdapi/v1/upscalers", [{"name": "R-ESRGAN 4x+"}]),
+            ("/sdapi/v1/embeddings", {"loaded": {"fake-embedding": {}}}),
+        ):
+            app.router.add_get(path, self._static(items))
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    def _static(items):
+        async def handler(request):
+            return web.json_response(items)
+        return handler
+
+    async def _run_on_gpu(self, latency: float):
+        """占用一个GPU槽位执行 latency 秒"""
+        self.requests += 1
+        async with self._gpu:
+            job_id = self._next_id
+            self._next_id += 1
+            self._running[job_id] = (time.monotonic(), latency)
+            try:
+                await asyncio.sleep(latency)
+            finally:
+                del self._running[job_id]
+
+    async def _txt2img(self, request):
+        payload = await request.json()
+        count = payload.get("batch_size", 1) * payload.get("n_iter", 1)
+        await self._run_on_gpu(self.txt2img_latency * payload.get("n_iter", 1))
+        return web.json_response({
+            "images": [self._image] * count,
+            "parameters": payload,
+            "info": "{}",
+        })
+
+    async def _extra_single(self, request):
+        await request.json()
+        await self._run_on_gpu(self.upscale_latency)
+        return web.json_response({"image": self._image, "html_info": ""})
+
+    async def _extra_batch(self, request):
+        payload = await request.json()
+        count = len(payload.get("imageList", []))
+        await self._run_on_gpu(self.upscale_latency * count)
+        return web.json_response({"images": [self._image] * count, "html_info": ""})
+
+    async def _progress(self, request):
+        if not self._running:
+            return web.json_response({"progress": 0.0, "eta_relative": 0.0, "state": {"job_count": 0}})
+        started_at, latency = next(iter(self._running.values()))
+        elapsed = time.monotonic() - started_at
+        return web.json_response({
+            "progress": min(elapsed / latency, 1.0) if latency else 1.0,
+            "eta_relative": max(latency - elapsed, 0.0),
+            "state": {"job_count": len(self._running)},
+            "current_image": None,
+        })
+
+    async def _interrupt(self, request):
+        self.interrupts += 1
+        return web.json_response({})
+
+    async def _memory(self, request):
+        active = VRAM_MODEL + VRAM_PER_JOB * len(self._running)
+        return web.json_response({
+            "cuda": {
+                "system": {"free": VRAM_TOTAL - active, "used": active, "total": VRAM_TOTAL},
+                "active": {"current": active, "peak": active},
+                "events": {"retries": 0, "oom": 0},
+            },
+        })
+
+    async def _options(self, request):
+        await request.json()
+        return web.json_response({})
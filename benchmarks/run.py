@@ -0,0 +1,251 @@
+"""插件基准测试
+
+启动进程内的模拟 WebUI（见 fake_webui.py），通过模拟的 AstrBot 消息事件驱动 ImageProcessor，
+在不同并发数下统计吞吐量、端到端延迟的 p50/p99 与进程的峰值常驻内存（RSS）。
+模拟 WebUI 的耗时是已知的，延迟中超出的部分就是插件自身的开销与排队时间。
+
+需要在安装了 AstrBot 的环境中运行（消息结果与图像组件使用 AstrBot 的实现）：
+
+    python benchmarks/run.py --concurrency 1,4,16 --requests 32 --latency 0.5 --image-kb 1500
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from astrbot.api.event import MessageEventResult  # noqa: E402
+
+from fake_webui import FakeWebUI  # noqa: E402
+
+plugin = importlib.import_module(os.path.basename(PLUGIN_DIR))
+
+
+class BenchConfig(dict):
+    """以 _conf_schema.json 的默认值构建的插件配置，保存操作为空操作"""
+
+    def __init__(self, overrides: dict):
+        with open(os.path.join(PLUGIN_DIR, "_conf_schema.json"), encoding="utf-8") as f:
+            schema = json.load(f)
+        values = {}
+        for key, item in schema.items():
+            if item.get("type") == "object":
+                values[key] = {name: sub.get("default") for name, sub in item["items"].items()}
+            else:
+                values[key] = item.get("default")
+        values.update(overrides)
+        super().__init__(values)
+
+    def save_config(self, replace_config: dict = None):
+        pass
+
+
+class BenchEvent:
+    """模拟的消息事件，记录收到的结果"""
+
+    def __init__(self, sender_id: str, group_id: str = ""):
+        self.sender_id = sender_id
+        self.group_id = group_id
+        self.images = 0
+        self.errors = []
+
+    def get_sender_id(self) -> str:
+        return self.sender_id
+
+    def get_group_id(self) -> str:
+        return self.group_id
+
+    def get_platform_name(self) -> str:
+        return "benchmark"
+
+    def is_admin(self) -> bool:
+        return False
+
+    def plain_result(self, text: str) -> MessageEventResult:
+        if text.startswith(("❌", "⚠️")):
+            self.errors.append(text)
+        return MessageEventResult().message(text)
+
+    def chain_result(self, chain: list) -> MessageEventResult:
+        self.images += sum(1 for component in chain if type(component).__name__ == "Image")
+        return MessageEventResult(chain=list(chain))
+
+    async def send(self, result):
+        pass
+
+
+class RssSampler:
+    """定期采样当前进程的常驻内存，记录峰值（字节）"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    @staticmethod
+    def current() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            pass
+        try:
+            # 非 Linux 平台只能取进程启动以来的峰值；Windows 没有 resource 模块
+            import resource
+        except ImportError:
+            return 0
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, self.current())
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self.peak = max(self.peak, self.current())
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def one_request(processor, index: int, groups: int) -> tuple:
+    """发起一次生成请求，返回（端到端延迟, 图像数, 错误信息列表）"""
+    event = BenchEvent(f"user{index}", f"group{index % groups}" if groups else "")
+    start = time.perf_counter()
+    async for _ in processor.generate_image_with_scheduler(event, f"benchmark prompt {index}"):
+        pass
+    return time.perf_counter() - start, event.images, event.errors
+
+
+async def run_level(processor, concurrency: int, total: int, groups: int) -> dict:
+    """以固定并发数完成 total 个请求"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(index):
+        async with semaphore:
+            return await one_request(processor, index, groups)
+
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(worker(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _, errors in results if not errors]
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": sum(1 for _, _, errors in results if errors),
+        "throughput": total / elapsed,
+        "images_per_second": sum(images for _, images, _ in results) / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "mean": statistics.fmean(latencies) if latencies else 0.0,
+        "peak_rss_mb": rss.peak / 1024 / 1024,
+    }
+
+
+async def main(args):
+    webui = FakeWebUI(
+        txt2img_latency=args.latency,
+        upscale_latency=args.upscale_latency,
+        image_kb=args.image_kb,
+        gpu_slots=args.gpu_slots,
+    )
+    await webui.start()
+    work_dir = tempfile.mkdtemp(prefix="sdgen-bench-")
+
+    config = BenchConfig({
+        "webui_url": webui.url,
+        "verbose": False,
+        "async_job_mode": False,
+        "progress_message_interval": 0,
+        "enable_upscale": args.upscale,
+        "enable_generate_prompt": False,
+        "result_cache_max_mb": 0,
+        "spool_max_mb": 0 if args.no_spool else 1024,
+        "output_format": args.output_format,
+        "adaptive_concurrency": args.adaptive,
+    })
+    config["default_params"].update({"batch_size": args.batch_size, "n_iter": 1, "seed": -1})
+
+    config_manager = plugin.ConfigManager(config)
+    api_client = plugin.SDWebUIClient(config_manager)
+    image_encoder = plugin.ImageEncoder(config_manager)
+    image_spool = plugin.ImageSpool(os.path.join(work_dir, "spool"), config_manager.get_spool_max_bytes(), 3600)
+    processor = plugin.ImageProcessor(
+        api_client, config_manager, None, image_encoder, image_spool, plugin.PresetStore(config_manager)
+    )
+    processor.set_max_concurrent_tasks(args.max_tasks)
+
+    try:
+        await api_client.check_availability()
+        start = time.perf_counter()
+        for resource_type in ("model", "lora", "embedding", "sampler", "upscaler"):
+            await api_client.fetch_resources(resource_type)
+        print(f"资源列表获取: {(time.perf_counter() - start) * 1000:.1f} ms（5 类）")
+
+        print(f"模拟 WebUI: 生成 {args.latency}s/次，放大 {args.upscale_latency}s/张，"
+              f"图像 {args.image_kb}KB，GPU 并行 {args.gpu_slots}")
+        header = f"{'并发':>6}{'请求':>6}{'错误':>6}{'请求/秒':>10}{'图像/秒':>10}{'p50(s)':>9}{'p99(s)':>9}{'峰值RSS(MB)':>13}"
+        print(header)
+        for concurrency in args.concurrency:
+            stats = await run_level(processor, concurrency, args.requests, args.groups)
+            print(
+                f"{stats['concurrency']:>6}{stats['requests']:>6}{stats['errors']:>6}"
+                f"{stats['throughput']:>10.2f}{stats['images_per_second']:>10.2f}"
+                f"{stats['p50']:>9.3f}{stats['p99']:>9.3f}{stats['peak_rss_mb']:>13.1f}"
+            )
+            if processor.limiter is not None:
+                print(f"{'':>6}自适应并发数: {processor.limiter.limit}")
+        print(processor.metrics.summary())
+    finally:
+        await api_client.close_session()
+        await image_spool.stop()
+        image_encoder.shutdown()
+        await webui.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SDGen 插件基准测试")
+    parser.add_argument("--concurrency", default="1,4,16",
+                        type=lambda value: [int(item) for item in value.split(",")],
+                        help="逗号分隔的并发数列表")
+    parser.add_argument("--requests", type=int, default=32, help="每个并发级别的请求数")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟的单次生成耗时（秒）")
+    parser.add_argument("--upscale-latency", type=float, default=0.2, help="模拟的单张放大耗时（秒）")
+    parser.add_argument("--image-kb", type=int, default=1500, help="模拟返回的单张图像大小（KB）")
+    parser.add_argument("--batch-size", type=int, default=1, help="每次生成的图像数")
+    parser.add_argument("--gpu-slots", type=int, default=1, help="模拟 WebUI 同时执行的请求数")
+    parser.add_argument("--max-tasks", type=int, default=10, help="插件的最大并发生成数")
+    parser.add_argument("--groups", type=int, default=4, help="请求分布的群组数，0 表示全部为私聊")
+    parser.add_argument("--upscale", action="store_true", help="启用图像放大")
+    parser.add_argument("--adaptive", action="store_true", help="启用自适应并发数（--max-tasks 为上限）")
+    parser.add_argument("--output-format", default="original", choices=["original", "png", "webp", "jpeg"],
+                        help="输出编码格式（webp/jpeg 需要真实的PNG图像，模拟数据会编码失败并退回原图）")
+    parser.add_argument("--no-spool", action="store_true", help="不使用图像暂存区，图像保存在内存中")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
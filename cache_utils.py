@@ -0,0 +1,55 @@
+"""缓存工具模块，提供带过期时间的LRU缓存"""
+
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """容量有限、条目带过期时间的LRU缓存"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间戳, 值)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        """读取未过期的条目，并将其标记为最近使用"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= time.time():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires_at: float = None):
+        """写入条目，超出容量时淘汰最久未使用的条目"""
+        if self.maxsize <= 0:
+            return
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """删除指定条目"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
+
+    def items(self) -> list:
+        """按从旧到新的顺序返回未过期的条目 (key, 过期时间戳, 值)"""
+        now = time.time()
+        return [(key, expires_at, value) for key, (expires_at, value) in self._data.items() if expires_at > now]
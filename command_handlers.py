@@ -1,10 +1,14 @@
 """命令处理模块，处理各种sd命令"""
 
 import logging
+import re
+import time
 
 from .config_manager import ConfigManager
 from .image_processor import ImageProcessor
+from .presets import PresetStore
 from .resource_manager import ResourceManager
+from .tracing import Tracer
 
 logger = logging.getLogger(__name__)
 
@@ -12,28 +16,130 @@ logger = logging.getLogger(__name__)
 class CommandHandlers:
     """命令处理器"""
 
-    def __init__(self, config_manager: ConfigManager, image_processor: ImageProcessor, resource_manager: ResourceManager):
+    def __init__(self, config_manager: ConfigManager, image_processor: ImageProcessor, resource_manager: ResourceManager,
+                 preset_store: PresetStore, tracer: Tracer):
         self.config_manager = config_manager
         self.image_processor = image_processor
         self.resource_manager = resource_manager
+        self.preset_store = preset_store
+        self.tracer = tracer
 
     # 基础命令处理
     async def handle_check(self, event):
         """处理检查命令"""
         try:
-            available, status = await self.image_processor.api_client.check_availability()
-            if available:
-                yield event.plain_result("✅ 同Webui连接正常")
-            else:
-                yield event.plain_result("❌ 同Webui无连接，请检查配置和Webui工作状态")
+            pool = self.image_processor.api_client.pool
+            if any(backend.last_seen is None for backend in pool.backends):
+                # 尚未完成首次探测时立即探测一次
+                await self.image_processor.api_client.check_availability()
+
+            lines = ["✅ 同Webui连接正常" if pool.has_available() else "❌ 同Webui无连接，请检查配置和Webui工作状态"]
+            now = time.time()
+            for backend in pool.backends:
+                status = "正常" if backend.healthy else "熔断中"
+                latency = f"{backend.probe_latency * 1000:.0f}ms" if backend.probe_latency is not None else "未知"
+                last_seen = f"{now - backend.last_seen:.0f}秒前" if backend.last_seen else "从未"
+                lines.append(f"- {backend.url}：{status}，探测延迟 {latency}，最近在线 {last_seen}，进行中请求 {backend.in_flight}")
+            api_client = self.image_processor.api_client
+            if api_client.interrupt_count:
+                lines.append(
+                    f"⏹️ 已中断被放弃的生成 {api_client.interrupt_count} 次，"
+                    f"约回收GPU时间 {api_client.reclaimed_gpu_seconds:.0f} 秒"
+                )
+            limiter = self.image_processor.limiter
+            if limiter is not None:
+                line = f"🎚️ 自适应并发数：当前 {limiter.limit}（范围 {limiter.min_limit}~{limiter.max_limit}）"
+                if limiter.last_reason:
+                    line += f"，最近一次调整原因：{limiter.last_reason}"
+                lines.append(line)
+            yield event.plain_result("\n".join(lines))
         except Exception as e:
             logger.error(f"❌ 检查可用性错误，报错{e}")
             yield event.plain_result("❌ 检查可用性错误，请检查日志")
 
     async def handle_gen(self, event, prompt: str):
         """处理图像生成命令"""
-        async for result in self.image_processor.generate_image_with_semaphore(event, prompt):
-            yield result
+        trace = self.tracer.start("sd.gen", sender=str(event.get_sender_id()), group=str(event.get_group_id() or ""))
+        try:
+            async for result in self.image_processor.generate_image_with_scheduler(event, prompt, trace):
+                yield result
+        finally:
+            trace.release()
+
+    async def handle_status(self, event, job_id: str = ""):
+        """处理任务状态查询命令"""
+        try:
+            jobs = self.image_processor.jobs
+            if job_id:
+                job = jobs.get(str(job_id).strip())
+                if job is None:
+                    yield event.plain_result(f"⚠️ 未找到任务 {job_id}")
+                    return
+                yield event.plain_result(await self.image_processor.describe_job(job))
+                return
+
+            active = jobs.active_jobs(str(event.get_sender_id()))
+            if not active:
+                yield event.plain_result("📭 你当前没有进行中的任务")
+                return
+            descriptions = [await self.image_processor.describe_job(job) for job in active]
+            yield event.plain_result("\n".join(descriptions))
+        except Exception as e:
+            logger.error(f"查询任务状态失败: {e}")
+            yield event.plain_result("❌ 查询任务状态失败，请检查日志")
+
+    async def handle_cancel(self, event, job_id: str = ""):
+        """处理任务取消命令"""
+        try:
+            sender_id = str(event.get_sender_id())
+            jobs = self.image_processor.jobs
+            if job_id:
+                job = jobs.get(str(job_id).strip())
+            else:
+                # 未指定ID时取消自己最近提交的任务
+                active = jobs.active_jobs(sender_id)
+                job = active[-1] if active else None
+
+            if job is None:
+                yield event.plain_result("⚠️ 未找到可取消的任务")
+                return
+            if job.sender_key != sender_id and not event.is_admin():
+                yield event.plain_result("⛔ 只能取消自己提交的任务")
+                return
+            if not self.image_processor.cancel_job(job):
+                yield event.plain_result(f"⚠️ 任务 {job.job_id} 已结束（{job.state_text}），无法取消")
+                return
+            yield event.plain_result(f"🛑 正在取消任务 {job.job_id}")
+        except Exception as e:
+            logger.error(f"取消任务失败: {e}")
+            yield event.plain_result("❌ 取消任务失败，请检查日志")
+
+    async def handle_stats(self, event):
+        """处理统计信息查询命令"""
+        try:
+            yield event.plain_result(self.image_processor.metrics.summary())
+        except Exception as e:
+            logger.error(f"获取统计信息失败: {e}")
+            yield event.plain_result("❌ 获取统计信息失败，请检查日志")
+
+    async def handle_pick(self, event, indices: str = ""):
+        """处理从预览图中取回原图的命令"""
+        try:
+            numbers = [int(item) for item in re.split(r"[,，\s]+", str(indices)) if item.isdigit()]
+            if not numbers:
+                yield event.plain_result("⚠️ 请指定预览图中的序号，例如 /sd pick 1,3")
+                return
+
+            chain = await self.image_processor.pick_images(event, numbers)
+            if chain is None:
+                yield event.plain_result("⚠️ 预览图已过期或不存在，请重新生成")
+            elif not chain:
+                yield event.plain_result("⚠️ 序号超出范围，请对照预览图中的序号")
+            else:
+                yield event.chain_result(chain)
+        except Exception as e:
+            logger.error(f"取回原图失败: {e}")
+            yield event.plain_result("❌ 取回原图失败，请检查日志")
 
     async def handle_verbose(self, event):
         """处理详细模式切换命令"""
@@ -98,8 +204,9 @@ class CommandHandlers:
     async def handle_conf(self, event):
         """处理配置显示命令"""
         try:
-            gen_params = self.config_manager.get_generation_params()
-            scale_params = self.config_manager.get_upscale_params()
+            overrides = self.preset_store.overrides(event)
+            gen_params = self.config_manager.get_generation_params(overrides)
+            scale_params = self.config_manager.get_upscale_params(overrides)
             prompt_guidelines = self.config_manager.get_prompt_guidelines().strip() or "未设置"
 
             verbose = self.config_manager.get_verbose_mode()
@@ -116,6 +223,8 @@ class CommandHandlers:
                 f"📝  正向提示词显示: {'开启' if show_positive_prompt else '关闭'}\n\n"
                 f"🤖  提示词生成模式: {'开启' if generate_prompt else '关闭'}"
             )
+            if overrides:
+                conf_message += f"\n\n🎛️  已应用预设参数{self.preset_store.scope_label(event)}: {', '.join(overrides)}"
 
             yield event.plain_result(conf_message)
         except Exception as e:
@@ -130,9 +239,13 @@ class CommandHandlers:
             "",
             "📜 **主要功能指令**:",
             "- `/sd gen [提示词]`：生成图片，例如 `/sd gen 星空下的城堡`。",
-            "- `/sd check`：检查 WebUI 的连接状态。",
+            "- `/sd check`：检查 WebUI 的连接状态（含各后端的健康状态与探测延迟）。",
             "- `/sd conf`：显示当前使用配置，包括模型、参数和提示词设置。",
             "- `/sd help`：显示本帮助信息。",
+            "- `/sd status [任务ID]`：查看任务的排队位置与生成进度，不填ID时列出自己进行中的任务。",
+            "- `/sd cancel [任务ID]`：取消任务（排队中的直接移出队列，生成中的会中断 WebUI），不填ID时取消自己最近的任务。",
+            "- `/sd stats`：查看各阶段（提示词、排队、文生图、放大、编码、发送）的耗时分布，以及各后端的请求、错误与流量统计。",
+            "- `/sd pick [序号]`：从最近一次的网格预览图中取回原图，多个序号用英文逗号分隔，例如 `/sd pick 1,3`。",
             "",
             "🔧 **高级功能指令**:",
             "- `/sd verbose`：切换详细输出模式，用于实时告知目前AI生图进行到了哪个阶段。",
@@ -142,14 +255,16 @@ class CommandHandlers:
             "- `/sd timeout [秒数]`：设置连接超时时间（建议范围：10 到 300 秒）。",
             "- `/sd res  [宽度] [高度]`：设置图像生成的分辨率（高度和宽度均支持:1-2048之间的任意整数）。",
             "- `/sd step [步数]`：设置图像生成的步数（范围：10 到 50 步）。",
-            "- `/sd batch [数量]`：设置发出AI生图请求后，每轮生成的图片数量（范围： 1 到 10 张）。"
+            "- `/sd batch [数量]`：设置发出AI生图请求后，每轮生成的图片数量（范围： 1 到 10 张）。",
             "- `/sd iter [次数]`：设置迭代次数（范围： 1 到 5 次）。",
+            "- `/sd reset`：参数按群组或用户生效时，清除当前的预设参数，恢复使用全局参数。",
             "",
             "🖼️ **基本模型与微调模型指令**:",
             "- `/sd model list`：列出 WebUI 当前可用的模型。",
-            "- `/sd model set [索引]`：利用索引设置模型，索引可通过 `model list` 查询。",
+            "- `/sd model set [索引]`：利用索引设置模型，索引可通过 `model list` 查询，模型在下一次生成时加载。",
             "- `/sd lora`：列出所有可用的 LoRA 模型。",
             "- `/sd embedding`：显示所有已加载的 Embedding 模型。",
+            "- `/sd refresh`：强制从 WebUI 重新获取模型、LoRA、采样器等资源列表（资源列表默认会缓存一段时间）。",
             "",
             "🎨 **采样器与上采样算法指令**:",
             "- `/sd sampler list`：列出支持的采样器。",
@@ -159,7 +274,7 @@ class CommandHandlers:
             "",
             "ℹ️ **注意事项**:",
             "- 如启用自动生成提示词功能，则会使用 LLM 利用提供的内容来生成提示词。",
-            "- 如未启用自动生成提示词功能，若提供的自定义提示词中包含空格，则应使用 "~"（英文波浪号） 替代所有提示词中的空格，否则输入的自定义提示词组将在空格处中断。你可以在配置中修改想使用的字符。",
+            "- 如未启用自动生成提示词功能，若提供的自定义提示词中包含空格，则应使用 “~”（英文波浪号） 替代所有提示词中的空格，否则输入的自定义提示词组将在空格处中断。你可以在配置中修改想使用的字符。",
             "- 模型、采样器和其他资源的索引需要使用对应 `list` 命令获取后设置！",
         ]
         yield event.plain_result("\n".join(help_msg))
@@ -172,9 +287,10 @@ class CommandHandlers:
                 yield event.plain_result("⚠️ 分辨率仅支持:1-2048之间的任意整数")
                 return
 
-            self.config_manager.update_default_param("height", height)
-            self.config_manager.update_default_param("width", width)
-            yield event.plain_result(f"✅ 图像生成的分辨率已设置为: 宽度——{width}，高度——{height}")
+            self.preset_store.set_params(event, {"height": height, "width": width})
+            yield event.plain_result(
+                f"✅ 图像生成的分辨率已设置为: 宽度——{width}，高度——{height}{self.preset_store.scope_label(event)}"
+            )
         except Exception as e:
             logger.error(f"设置分辨率失败: {e}")
             yield event.plain_result("❌ 设置分辨率失败，请检查日志")
@@ -185,8 +301,8 @@ class CommandHandlers:
             if step < 10 or step > 50:
                 yield event.plain_result("⚠️ 步数需设置在 10 到 50 之间")
                 return
-            self.config_manager.update_default_param("steps", step)
-            yield event.plain_result(f"✅ 步数已设置为: {step}")
+            self.preset_store.set_params(event, {"steps": step})
+            yield event.plain_result(f"✅ 步数已设置为: {step}{self.preset_store.scope_label(event)}")
         except Exception as e:
             logger.error(f"设置步数失败: {e}")
             yield event.plain_result("❌ 设置步数失败，请检查日志")
@@ -197,8 +313,8 @@ class CommandHandlers:
             if batch_size < 1 or batch_size > 10:
                 yield event.plain_result("⚠️ 图片生成的批数量需设置在 1 到 10 之间")
                 return
-            self.config_manager.update_default_param("batch_size", batch_size)
-            yield event.plain_result(f"✅ 图片生成批数量已设置为: {batch_size}")
+            self.preset_store.set_params(event, {"batch_size": batch_size})
+            yield event.plain_result(f"✅ 图片生成批数量已设置为: {batch_size}{self.preset_store.scope_label(event)}")
         except Exception as e:
             logger.error(f"设置批量生成数量失败: {e}")
             yield event.plain_result("❌ 设置图片生成批数量失败，请检查日志")
@@ -209,12 +325,26 @@ class CommandHandlers:
             if n_iter < 1 or n_iter > 5:
                 yield event.plain_result("⚠️ 图片生成的迭代次数需设置在 1 到 5 之间")
                 return
-            self.config_manager.update_default_param("n_iter", n_iter)
-            yield event.plain_result(f"✅ 图片生成的迭代次数已设置为: {n_iter}")
+            self.preset_store.set_params(event, {"n_iter": n_iter})
+            yield event.plain_result(f"✅ 图片生成的迭代次数已设置为: {n_iter}{self.preset_store.scope_label(event)}")
         except Exception as e:
             logger.error(f"设置生成迭代次数失败: {e}")
             yield event.plain_result("❌ 设置图片生成的迭代次数失败，请检查日志")
 
+    async def handle_reset_params(self, event):
+        """处理清除参数预设命令"""
+        try:
+            if self.config_manager.get_param_scope() == "global":
+                yield event.plain_result("⚠️ 当前参数设置为全局生效，没有可清除的预设")
+                return
+            if not self.preset_store.reset(event):
+                yield event.plain_result("📭 当前没有设置过预设参数")
+                return
+            yield event.plain_result(f"✅ 已清除预设参数，恢复使用全局参数{self.preset_store.scope_label(event)}")
+        except Exception as e:
+            logger.error(f"清除预设参数失败: {e}")
+            yield event.plain_result("❌ 清除预设参数失败，请检查日志")
+
     # 资源管理命令
     async def handle_model_list(self, event):
         """处理模型列表命令"""
@@ -233,13 +363,30 @@ class CommandHandlers:
                 yield event.plain_result(error_msg)
                 return
 
-            if await self.resource_manager.set_model(model_name):
-                yield event.plain_result(f"✅ 模型已切换为: {model_name}")
-            else:
-                yield event.plain_result("⚠️ 切换模型失败，请检查 WebUI 状态")
+            # 不立即切换：调度器在需要其他模型的任务结束后，于下一次生成前加载该模型
+            self.preset_store.set_params(event, {"base_model": model_name})
+            yield event.plain_result(
+                f"✅ 模型已设置为: {model_name}{self.preset_store.scope_label(event)}，将在下一次生成时加载"
+            )
+        except Exception as e:
+            logger.error(f"设置模型失败: {e}")
+            yield event.plain_result("❌ 设置模型失败，请检查日志")
+
+    async def handle_refresh(self, event):
+        """处理资源列表刷新命令"""
+        try:
+            counts = await self.resource_manager.refresh_all()
+            yield event.plain_result(
+                "🔄 资源列表已刷新:\n"
+                f"- 模型: {counts['model']}\n"
+                f"- LoRA: {counts['lora']}\n"
+                f"- Embedding: {counts['embedding']}\n"
+                f"- 采样器: {counts['sampler']}\n"
+                f"- 上采样算法: {counts['upscaler']}"
+            )
         except Exception as e:
-            logger.error(f"切换模型失败: {e}")
-            yield event.plain_result("❌ 切换模型失败，请检查日志")
+            logger.error(f"刷新资源列表失败: {e}")
+            yield event.plain_result("❌ 刷新资源列表失败，请检查 WebUI 是否运行")
 
     async def handle_lora_list(self, event):
         """处理LoRA列表命令"""
@@ -280,8 +427,8 @@ class CommandHandlers:
                 yield event.plain_result(error_msg)
                 return
 
-            self.config_manager.update_default_param("sampler", sampler_name)
-            yield event.plain_result(f"✅ 已设置采样器为: {sampler_name}")
+            self.preset_store.set_params(event, {"sampler": sampler_name})
+            yield event.plain_result(f"✅ 已设置采样器为: {sampler_name}{self.preset_store.scope_label(event)}")
         except ValueError:
             yield event.plain_result("❌ 请输入有效的数字索引")
         except Exception as e:
@@ -304,8 +451,8 @@ class CommandHandlers:
                 yield event.plain_result(error_msg)
                 return
 
-            self.config_manager.update_default_param("upscaler", upscaler_name)
-            yield event.plain_result(f"✅ 已设置上采样算法为: {upscaler_name}")
+            self.preset_store.set_params(event, {"upscaler": upscaler_name})
+            yield event.plain_result(f"✅ 已设置上采样算法为: {upscaler_name}{self.preset_store.scope_label(event)}")
         except ValueError:
             yield event.plain_result("❌ 请输入有效的数字索引")
         except Exception as e:
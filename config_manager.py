@@ -1,6 +1,10 @@
 """配置管理模块"""
 
 import os
+from urllib.parse import urlsplit, urlunsplit
+
+from .config_snapshot import ConfigSnapshot
+from .persistence import DebouncedWriter
 
 
 class ConfigManager:
@@ -8,23 +12,33 @@ class ConfigManager:
 
     def __init__(self, config):
         self.config = config
+        self.writer = DebouncedWriter(config)
+        # 缓存的配置快照，配置被修改后置空，下次获取时重建
+        self._snapshot = None
+        self._version = 0
 
     def validate_config(self):
         """配置验证"""
-        self.config["webui_url"] = self.config["webui_url"].strip()
-        if not self.config["webui_url"].startswith(("http://", "https://")):
-            raise ValueError("WebUI地址必须以http://或https://开头")
+        raw_urls = self.config["webui_url"]
+        urls = self.get_webui_urls()
+        if not urls:
+            raise ValueError("WebUI地址不能为空")
+        for url in urls:
+            if not url.startswith(("http://", "https://")):
+                raise ValueError("WebUI地址必须以http://或https://开头")
 
-        if self.config["webui_url"].endswith("/"):
-            self.config["webui_url"] = self.config["webui_url"].rstrip("/")
-            self.config.save_config()
+        normalized = ",".join(urls) if isinstance(raw_urls, str) else urls
+        if normalized != raw_urls:
+            self.config["webui_url"] = normalized
+            self._invalidate_snapshot()
+            self.writer.schedule()
 
-    def get_generation_params(self) -> str:
-        """获取当前图像生成的参数"""
+    def get_generation_params(self, overrides: dict = None) -> str:
+        """获取当前图像生成的参数，overrides 为预设中覆盖的参数"""
         positive_prompt_global = self.config.get("positive_prompt_global", "")
         negative_prompt_global = self.config.get("negative_prompt_global", "")
 
-        params = self.config.get("default_params", {})
+        params = {**self.config.get("default_params", {}), **(overrides or {})}
         width = params.get("width") or "未设置"
         height = params.get("height") or "未设置"
         steps = params.get("steps") or "未设置"
@@ -32,8 +46,9 @@ class ConfigManager:
         cfg_scale = params.get("cfg_scale") or "未设置"
         batch_size = params.get("batch_size") or "未设置"
         n_iter = params.get("n_iter") or "未设置"
+        seed = params.get("seed", -1)
 
-        base_model = self.config.get("base_model").strip() or "未设置"
+        base_model = params.get("base_model") or self.get_base_model() or "未设置"
 
         return (
             f"- 全局正面提示词: {positive_prompt_global}\n"
@@ -44,12 +59,13 @@ class ConfigManager:
             f"- 采样器: {sampler}\n"
             f"- CFG比例: {cfg_scale}\n"
             f"- 批数量: {batch_size}\n"
-            f"- 迭代次数: {n_iter}"
+            f"- 迭代次数: {n_iter}\n"
+            f"- 种子: {'随机' if seed == -1 else seed}"
         )
 
-    def get_upscale_params(self) -> str:
-        """获取当前图像增强（超分辨率放大）参数"""
-        params = self.config["default_params"]
+    def get_upscale_params(self, overrides: dict = None) -> str:
+        """获取当前图像增强（超分辨率放大）参数，overrides 为预设中覆盖的参数"""
+        params = {**self.config["default_params"], **(overrides or {})}
         upscale_factor = params["upscale_factor"] or "2"
         upscaler = params["upscaler"] or "未设置"
 
@@ -63,17 +79,167 @@ class ConfigManager:
         return self.config.get("session_timeout_time", 120)
 
     def get_webui_url(self):
-        """获取WebUI URL"""
-        return self.config["webui_url"]
+        """获取首个WebUI URL"""
+        return self.get_webui_urls()[0]
+
+    def get_webui_urls(self) -> list:
+        """获取全部WebUI后端地址，支持列表或以英文逗号分隔的字符串
+
+        同一地址（忽略末尾斜杠与协议、主机名的大小写）只保留第一次出现的，
+        否则同一个 WebUI 会被当作多个后端，进行中调用的顺序与中断判断都会出错。
+        """
+        raw_urls = self.config["webui_url"]
+        if isinstance(raw_urls, str):
+            raw_urls = raw_urls.split(",")
+        urls = {}
+        for url in raw_urls:
+            if not url or not url.strip():
+                continue
+            url = url.strip().rstrip("/")
+            parts = urlsplit(url)
+            key = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, parts.fragment))
+            urls.setdefault(key, url)
+        return list(urls.values())
+
+    def get_health_check_interval(self):
+        """获取后端健康探测间隔（秒）"""
+        return max(1, self.config.get("health_check_interval", 15))
+
+    def get_health_failure_threshold(self):
+        """获取触发熔断的连续失败次数"""
+        return self.config.get("health_failure_threshold", 3)
+
+    def get_health_circuit_cooldown(self):
+        """获取熔断冷却时间（秒）"""
+        return self.config.get("health_circuit_cooldown", 30)
+
+    def get_prompt_concurrency(self):
+        """获取提示词准备阶段（LLM）的最大并发数"""
+        return max(1, self.config.get("prompt_concurrency", 4))
+
+    def get_postprocess_concurrency(self):
+        """获取后处理阶段（图像增强等）的最大并发数"""
+        return max(1, self.config.get("postprocess_concurrency", 4))
+
+    def get_model_affinity_max_skips(self):
+        """获取排队任务最多被其他模型的任务插队的次数"""
+        return self.config.get("model_affinity_max_skips", 5)
+
+    def get_max_concurrent_tasks(self):
+        """获取最大并发生成数，自适应限流时为并发上限"""
+        return max(1, self.config.get("max_concurrent_tasks", 10))
+
+    def get_min_concurrent_tasks(self):
+        """获取自适应限流的并发下限"""
+        return min(max(1, self.config.get("min_concurrent_tasks", 1)), self.get_max_concurrent_tasks())
+
+    def get_adaptive_concurrency(self):
+        """获取是否根据后端延迟、错误与显存占用自动调整并发数"""
+        return self.config.get("adaptive_concurrency", False)
+
+    def get_vram_high_watermark(self) -> float:
+        """获取显存占用率的上限（0~1），超过时降低并发数"""
+        return min(max(float(self.config.get("vram_high_watermark", 0.9)), 0.1), 1.0)
+
+    def get_result_cache_max_bytes(self):
+        """获取结果缓存的字节预算，0 表示禁用"""
+        return max(0, self.config.get("result_cache_max_mb", 512)) * 1024 * 1024
+
+    def get_spool_max_bytes(self):
+        """获取图像暂存区的容量（字节），0 表示不暂存"""
+        return max(0, self.config.get("spool_max_mb", 0)) * 1024 * 1024
+
+    def get_spool_max_age(self):
+        """获取暂存区中图像的最长保留时间（秒）"""
+        return self.config.get("spool_max_age", 3600)
+
+    def get_param_scope(self):
+        """获取参数设置命令的作用范围：global（全局）、group（按群组）或 user（按用户）"""
+        scope = self.config.get("param_scope", "global")
+        return scope if scope in ("global", "group", "user") else "global"
+
+    def get_metrics_file(self):
+        """获取 Prometheus 指标文件的写入路径，为空表示不写入"""
+        return (self.config.get("metrics_file") or "").strip()
+
+    def get_metrics_port(self):
+        """获取 Prometheus 指标接口的本地端口，0 表示不启动"""
+        return self.config.get("metrics_port", 0)
+
+    def get_trace_sample_rate(self) -> float:
+        """获取请求追踪的采样率（0~1），0 表示不导出追踪"""
+        return min(max(float(self.config.get("trace_sample_rate", 0.0)), 0.0), 1.0)
 
     def get_verbose_mode(self):
         """获取详细输出模式"""
         return self.config.get("verbose", True)
 
+    def get_progress_message_interval(self):
+        """获取详细模式下进度消息的最小发送间隔（秒），0 表示不发送进度"""
+        return self.config.get("progress_message_interval", 15)
+
+    def get_progress_preview(self):
+        """获取进度消息是否附带预览图"""
+        return self.config.get("progress_preview", False)
+
+    def get_async_job_mode(self):
+        """获取是否启用异步任务模式（提交后立即返回任务ID）"""
+        return self.config.get("async_job_mode", False)
+
     def get_upscale_enabled(self):
         """获取图像增强模式状态"""
         return self.config.get("enable_upscale", False)
 
+    def get_upscale_mode(self):
+        """获取多张图像的放大方式：batch（一次请求整批放大）或 concurrent（并发逐张放大）"""
+        mode = self.config.get("upscale_mode", "batch")
+        return mode if mode in ("batch", "concurrent") else "batch"
+
+    def get_upscale_concurrency(self):
+        """获取并发放大时同时进行的请求数"""
+        return max(1, self.config.get("upscale_concurrency", 4))
+
+    def get_output_format(self):
+        """获取输出图像的编码格式：original（原样发送）、png（移除文本块）、webp 或 jpeg"""
+        fmt = str(self.config.get("output_format", "original")).lower()
+        return fmt if fmt in ("original", "png", "webp", "jpeg") else "original"
+
+    def get_output_quality(self):
+        """获取未设置字节预算时 webp/jpeg 的编码质量"""
+        return min(max(self.config.get("output_quality", 90), 1), 100)
+
+    def get_output_max_bytes(self, platform: str = "") -> int:
+        """获取单张输出图像的字节预算，平台单独配置的预算优先，0 表示不限制"""
+        overrides = self.get_output_platform_max_bytes()
+        if platform and platform in overrides:
+            return overrides[platform]
+        return max(0, self.config.get("output_max_kb", 0)) * 1024
+
+    def get_output_platform_max_bytes(self) -> dict:
+        """获取按平台单独配置的字节预算（平台名 -> 字节数）"""
+        overrides = {}
+        for item in str(self.config.get("output_platform_max_kb", "")).split(","):
+            name, _, kb = item.partition(":")
+            if name.strip() and kb.strip().isdigit():
+                overrides.setdefault(name.strip(), int(kb.strip()) * 1024)
+        return overrides
+
+    def get_encode_workers(self):
+        """获取图像编码进程池的进程数"""
+        return max(1, self.config.get("encode_workers", 2))
+
+    def get_contact_sheet_threshold(self):
+        """获取拼合为预览图的最少图像数，0 表示不拼合"""
+        return max(0, self.config.get("contact_sheet_threshold", 0))
+
+    def get_contact_sheet_cell_size(self):
+        """获取预览图中每张缩略图的边长（像素）"""
+        return max(64, self.config.get("contact_sheet_cell_size", 384))
+
+    def get_pick_store_ttl(self):
+        """获取预览图对应原图的保留时间（秒）"""
+        return self.config.get("pick_store_ttl", 600)
+
     def get_show_positive_prompt(self):
         """获取显示正向提示词状态"""
         return self.config.get("enable_show_positive_prompt", False)
@@ -98,20 +264,53 @@ class ConfigManager:
         """获取默认参数"""
         return self.config["default_params"]
 
+    def get_base_model(self):
+        """获取基础模型"""
+        return (self.config.get("base_model") or "").strip()
+
     def get_prompt_guidelines(self):
         """获取提示词指导原则"""
         return self.config.get("prompt_guidelines", "")
 
+    def get_prompt_cache_size(self):
+        """获取LLM提示词缓存的最大条目数，0 表示禁用"""
+        return self.config.get("prompt_cache_size", 256)
+
+    def get_prompt_cache_ttl(self):
+        """获取LLM提示词缓存的有效期（秒）"""
+        return self.config.get("prompt_cache_ttl", 86400)
+
+    def get_prompt_cache_persist(self):
+        """获取是否将LLM提示词缓存持久化到磁盘"""
+        return self.config.get("prompt_cache_persist", False)
+
     def get_replace_space_char(self):
         """获取空格替换字符"""
         return self.config.get("replace_space", "~")
 
+    async def flush(self):
+        """立即保存尚未写入磁盘的配置修改"""
+        await self.writer.flush()
+
+    def snapshot(self) -> ConfigSnapshot:
+        """获取当前配置的不可变快照，配置未修改时复用同一份快照"""
+        if self._snapshot is None:
+            self._snapshot = ConfigSnapshot(self, self._version)
+        return self._snapshot
+
+    def _invalidate_snapshot(self):
+        """配置被修改，丢弃缓存的快照；已获取快照的请求不受影响"""
+        self._version += 1
+        self._snapshot = None
+
     def update_config(self, key: str, value):
         """更新配置并保存"""
         self.config[key] = value
-        self.config.save_config()
+        self._invalidate_snapshot()
+        self.writer.schedule()
 
     def update_default_param(self, param: str, value):
         """更新默认参数并保存"""
         self.config["default_params"][param] = value
-        self.config.save_config()
\ No newline at end of file
+        self._invalidate_snapshot()
+        self.writer.schedule()
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""配置快照模块，为每个请求提供一份不可变的配置"""
+
+from types import MappingProxyType
+
+
+class ConfigSnapshot:
+    """一次请求所使用的配置快照
+
+    快照在请求开始时获取一次，之后请求的各个阶段只读取快照，不受其他命令（如 /sd res、
+    /sd step）中途修改配置的影响。生成与放大请求的参数模板在创建快照时预先构建，
+    构建请求时只需填入提示词或图像。快照由 ConfigManager 缓存，仅在配置被修改后重建。
+    overrides 为群组或用户预设中覆盖的参数，其中的 base_model 覆盖全局的基础模型。
+    """
+
+    __slots__ = (
+        "version",
+        "base_model",
+        "verbose",
+        "show_positive_prompt",
+        "generate_prompt",
+        "replace_space",
+        "positive_prompt_global",
+        "positive_prompt_in_head",
+        "upscale_enabled",
+        "upscale_mode",
+        "upscale_concurrency",
+        "output_format",
+        "output_quality",
+        "output_max_bytes",
+        "output_platform_max_bytes",
+        "contact_sheet_threshold",
+        "contact_sheet_cell_size",
+        "payload_template",
+        "upscale_template",
+    )
+
+    def __init__(self, config_manager, version: int = 0, overrides: dict = None):
+        params = {**config_manager.get_default_params(), **(overrides or {})}
+        values = {
+            "version": version,
+            "base_model": params.get("base_model") or config_manager.get_base_model(),
+            "verbose": config_manager.get_verbose_mode(),
+            "show_positive_prompt": config_manager.get_show_positive_prompt(),
+            "generate_prompt": config_manager.get_generate_prompt_enabled(),
+            "replace_space": config_manager.get_replace_space_char(),
+            "positive_prompt_global": config_manager.get_positive_prompt_global(),
+            "positive_prompt_in_head": config_manager.get_positive_prompt_add_position(),
+            "upscale_enabled": config_manager.get_upscale_enabled(),
+            "upscale_mode": config_manager.get_upscale_mode(),
+            "upscale_concurrency": config_manager.get_upscale_concurrency(),
+            "output_format": config_manager.get_output_format(),
+            "output_quality": config_manager.get_output_quality(),
+            "output_max_bytes": config_manager.get_output_max_bytes(),
+            "output_platform_max_bytes": MappingProxyType(config_manager.get_output_platform_max_bytes()),
+            "contact_sheet_threshold": config_manager.get_contact_sheet_threshold(),
+            "contact_sheet_cell_size": config_manager.get_contact_sheet_cell_size(),
+            "payload_template": MappingProxyType({
+                "negative_prompt": config_manager.get_negative_prompt_global(),
+                "width": params["width"],
+                "height": params["height"],
+                "steps": params["steps"],
+                "sampler_name": params["sampler"],
+                "cfg_scale": params["cfg_scale"],
+                "batch_size": params["batch_size"],
+                "n_iter": params["n_iter"],
+                "seed": params.get("seed", -1),
+            }),
+            "upscale_template": MappingProxyType({
+                "upscaling_resize": params["upscale_factor"] or "2",
+                "upscaler_1": params["upscaler"] or "未设置",
+                "resize_mode": 0,
+                "show_extras_results": True,
+                "upscaling_resize_w": 1,
+                "upscaling_resize_h": 1,
+                "upscaling_crop": False,
+                "gfpgan_visibility": 0,
+                "codeformer_visibility": 0,
+                "codeformer_weight": 0,
+                "extras_upscaler_2_visibility": 0
+            }),
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("配置快照不可修改")
+
+    def __delattr__(self, name):
+        raise AttributeError("配置快照不可修改")
+
+    def build_payload(self, prompt: str) -> dict:
+        """基于参数模板构建图像生成请求"""
+        payload = {"prompt": prompt}
+        payload.update(self.payload_template)
+        return payload
+
+    def build_upscale_payload(self) -> dict:
+        """基于参数模板构建图像放大请求的公共参数"""
+        return dict(self.upscale_template)
+
+    def max_bytes_for(self, platform: str = "") -> int:
+        """获取发往指定平台的单张图像的字节预算，0 表示不限制"""
+        return self.output_platform_max_bytes.get(platform, self.output_max_bytes) if platform else self.output_max_bytes
+
+    def trans_prompt(self, prompt: str) -> str:
+        """将提示词中的空格替换字符替换为空格"""
+        return prompt.replace(self.replace_space, " ")
+
+    def combine_with_global_positive_prompt(self, prompt: str) -> str:
+        """将提示词与全局正面提示词组合"""
+        if self.positive_prompt_in_head:
+            return self.positive_prompt_global + prompt
+        return prompt + self.positive_prompt_global
@@ -0,0 +1,68 @@
+"""健康监测模块，在后台周期性探测各WebUI后端并缓存其状态"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """后端健康监测器"""
+
+    def __init__(self, api_client, config_manager):
+        self.api_client = api_client
+        self.config_manager = config_manager
+        self._task = None
+
+    def start(self):
+        """启动后台探测任务（需在事件循环中调用，重复调用无副作用）"""
+        if self._task and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        """停止后台探测任务"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        """按配置的间隔循环探测所有后端"""
+        while True:
+            try:
+                await self.probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"后端健康探测异常: {e}")
+            await asyncio.sleep(self.config_manager.get_health_check_interval())
+
+    async def probe_all(self):
+        """并发探测所有后端"""
+        await self.api_client.ensure_session()
+        await asyncio.gather(*(self._probe(b) for b in self.api_client.pool.backends))
+
+    async def _probe(self, backend):
+        """探测单个后端，熔断冷却期内跳过"""
+        if backend.circuit_open():
+            return
+
+        pool = self.api_client.pool
+        start = time.perf_counter()
+        available, status = await self.api_client.check_backend(backend)
+        self.api_client.metrics.observe("stage_seconds", time.perf_counter() - start, stage="availability")
+        if available:
+            pool.mark_success(backend, time.perf_counter() - start)
+        else:
+            pool.mark_failure(backend, status)
+            if not backend.healthy:
+                logger.warning(f"⚠️ WebUI后端 {backend.url} 连续 {backend.consecutive_failures} 次探测失败，已熔断")
@@ -0,0 +1,227 @@
+"""输出编码模块，在进程池中将生成的PNG图像转码为体积更小的格式或拼合为预览图"""
+
+import asyncio
+import importlib.util
+import io
+import logging
+import math
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .config_snapshot import ConfigSnapshot
+from .image_record import ImageRecord
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ("original", "png", "webp", "jpeg")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG 中保存文本的块，WebUI 会把完整的生成参数写入其中
+PNG_TEXT_CHUNKS = (b"tEXt", b"iTXt", b"zTXt")
+# 按字节预算搜索质量时的取值范围
+MIN_QUALITY = 30
+MAX_QUALITY = 95
+# 最低质量仍超出预算时，每轮缩小尺寸的最大次数
+MAX_DOWNSCALE_ROUNDS = 4
+# 预览图的编码质量
+CONTACT_SHEET_QUALITY = 85
+
+
+def strip_png_text(data: bytes) -> bytes:
+    """移除PNG中的文本块，其余块原样保留；不是PNG时返回原数据"""
+    if not data.startswith(PNG_SIGNATURE):
+        return data
+    view = memoryview(data)
+    out = bytearray(PNG_SIGNATURE)
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", view[pos:pos + 8])
+        end = pos + 12 + length
+        if chunk_type not in PNG_TEXT_CHUNKS:
+            out += view[pos:end]
+        pos = end
+        if chunk_type == b"IEND":
+            break
+    return bytes(out)
+
+
+def _save(image, fmt: str, quality: int) -> bytes:
+    """以指定质量编码图像，不携带任何元数据"""
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _search_quality(image, fmt: str, max_bytes: int):
+    """二分查找不超出字节预算的最高质量，返回编码结果；最低质量仍超出时返回 None"""
+    best = None
+    low, high = MIN_QUALITY, MAX_QUALITY
+    while low <= high:
+        quality = (low + high) // 2
+        encoded = _save(image, fmt, quality)
+        if len(encoded) <= max_bytes:
+            best = encoded
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best
+
+
+def _open(source):
+    """打开图像，source 为文件路径或图像字节"""
+    from PIL import Image
+    return Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def transcode(source, fmt: str, quality: int, max_bytes: int) -> bytes:
+    """将图像转码为 webp 或 jpeg（在工作进程中执行），source 为文件路径或图像字节
+
+    max_bytes 大于 0 时按预算搜索质量，最低质量仍超出预算则按比例缩小尺寸后重试；
+    否则使用固定的 quality。
+    """
+    from PIL import Image
+
+    with _open(source) as opened:
+        image = opened.convert("RGB" if fmt == "jpeg" or opened.mode not in ("RGBA", "LA") else "RGBA")
+
+    if max_bytes <= 0:
+        return _save(image, fmt, quality)
+
+    for _ in range(MAX_DOWNSCALE_ROUNDS):
+        encoded = _search_quality(image, fmt, max_bytes)
+        if encoded is not None:
+            return encoded
+        # 体积大致与像素数成正比，按预算与最低质量体积之比缩小边长
+        smallest = len(_save(image, fmt, MIN_QUALITY))
+        scale = max(min((max_bytes / smallest) ** 0.5 * 0.95, 0.9), 0.25)
+        image = image.resize(
+            (max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+            Image.LANCZOS
+        )
+    return _save(image, fmt, MIN_QUALITY)
+
+
+def compose_contact_sheet(images: list, cell_size: int) -> bytes:
+    """将一组图像缩略后拼合为带序号的网格预览图（在工作进程中执行），返回JPEG字节
+
+    images 中的每一项为文件路径或图像字节。
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    sheet = Image.new("RGB", (columns * cell_size, rows * cell_size), (32, 32, 32))
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+
+    for position, source in enumerate(images):
+        with _open(source) as opened:
+            thumbnail = opened.convert("RGB")
+        thumbnail.thumbnail((cell_size, cell_size), Image.LANCZOS)
+        left = position % columns * cell_size + (cell_size - thumbnail.width) // 2
+        top = position // columns * cell_size + (cell_size - thumbnail.height) // 2
+        sheet.paste(thumbnail, (left, top))
+
+        # 左上角标注从 1 开始的序号，与取图命令中的序号一致
+        label = str(position + 1)
+        x0, y0, x1, y1 = draw.textbbox((0, 0), label, font=font)
+        cell_left, cell_top = position % columns * cell_size, position // columns * cell_size
+        draw.rectangle(
+            (cell_left, cell_top, cell_left + x1 - x0 + 8, cell_top + y1 - y0 + 8),
+            fill=(0, 0, 0)
+        )
+        draw.text((cell_left + 4 - x0, cell_top + 4 - y0), label, fill=(255, 255, 255), font=font)
+
+    buffer = io.BytesIO()
+    sheet.save(buffer, "JPEG", quality=CONTACT_SHEET_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+class ImageEncoder:
+    """输出编码器
+
+    转码是CPU密集的操作，放在独立的进程池中执行，不阻塞事件循环，多张图像可以并行编码。
+    进程池在第一次使用时创建。未安装 Pillow 时 webp/jpeg 会退回为仅移除文本块的PNG。
+    """
+
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        self._executor = None
+        self._pillow_available = importlib.util.find_spec("PIL") is not None
+        self.saved_bytes = 0
+        if not self._pillow_available:
+            logger.warning("未安装 Pillow：webp/jpeg 输出将仅移除PNG文本块，批量结果不会拼合为预览图")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.config_manager.get_encode_workers())
+        return self._executor
+
+    def _resolve_format(self, config: ConfigSnapshot) -> str:
+        fmt = config.output_format
+        if fmt in ("webp", "jpeg") and not self._pillow_available:
+            return "png"
+        return fmt
+
+    async def encode(self, record: ImageRecord, config: ConfigSnapshot, platform: str = "") -> ImageRecord:
+        """按配置快照编码一张图像，失败时返回原图像"""
+        fmt = self._resolve_format(config)
+        if fmt == "original":
+            return record
+        if fmt == "png":
+            # 大图的逐块复制也是CPU操作，放到线程中执行
+            encoded = await asyncio.to_thread(strip_png_text, await record.read())
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                encoded = await loop.run_in_executor(
+                    self._get_executor(),
+                    transcode,
+                    record.path or record.data,
+                    fmt,
+                    config.output_quality,
+                    config.max_bytes_for(platform)
+                )
+            except BrokenProcessPool as e:
+                logger.error(f"图像编码进程异常退出，发送原图: {e}")
+                self._executor = None
+                return record
+            except Exception as e:
+                logger.error(f"图像编码失败，发送原图: {e}")
+                return record
+
+        self.saved_bytes += max(0, record.size - len(encoded))
+        return ImageRecord(data=encoded, index=record.index, upscaled=record.upscaled)
+
+    @property
+    def can_compose(self) -> bool:
+        """是否可以拼合预览图（需要 Pillow）"""
+        return self._pillow_available
+
+    async def compose_contact_sheet(self, records: list, config: ConfigSnapshot) -> ImageRecord:
+        """在进程池中将一组图像拼合为预览图，失败时返回 None"""
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(
+                self._get_executor(),
+                compose_contact_sheet,
+                [record.path or record.data for record in records],
+                config.contact_sheet_cell_size
+            )
+        except BrokenProcessPool as e:
+            logger.error(f"图像编码进程异常退出，无法拼合预览图: {e}")
+            self._executor = None
+            return None
+        except Exception as e:
+            logger.error(f"拼合预览图失败: {e}")
+            return None
+        return ImageRecord(data=data)
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
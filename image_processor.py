@@ -1,69 +1,289 @@
 """图像处理模块，负责图像生成和处理相关功能"""
 
 import asyncio
-import base64
+import hashlib
+import json
 import logging
+import os
 import re
+import time
 
+from .adaptive_limiter import AdaptiveLimiter
 from .api_client import SDWebUIClient
+from .backend_pool import BackendCall
+from .cache_utils import TTLCache
 from .config_manager import ConfigManager
+from .config_snapshot import ConfigSnapshot
+from .image_encoder import ImageEncoder
+from .image_record import ImageRecord
+from .image_spool import ImageSpool
+from .jobs import GenerationJob, JobRegistry, SharedGeneration
+from .presets import PresetStore
+from .progress_watcher import ProgressWatcher
+from .result_cache import ResultCache
+from .scheduler import FairScheduler, Ticket
+from .tracing import Trace, use_trace
 
 logger = logging.getLogger(__name__)
 
+# 保留预览图原图的最大会话数
+PICK_STORE_SIZE = 64
+# 插件终止时等待任务结束（包括中断WebUI上的生成）的最长时间（秒）
+SHUTDOWN_TIMEOUT = 10
+
 
 class ImageProcessor:
     """图像处理器"""
 
-    def __init__(self, api_client: SDWebUIClient, config_manager: ConfigManager):
+    def __init__(self, api_client: SDWebUIClient, config_manager: ConfigManager, result_cache: ResultCache = None,
+                 image_encoder: ImageEncoder = None, image_spool: ImageSpool = None, preset_store: PresetStore = None):
         self.api_client = api_client
         self.config_manager = config_manager
-        self.active_tasks = 0
+        self.result_cache = result_cache
+        self.image_encoder = image_encoder
+        self.image_spool = image_spool
+        self.preset_store = preset_store
+        self.metrics = api_client.metrics
         self.max_concurrent_tasks = 10  # 默认最大并发数
-        self.task_semaphore = asyncio.Semaphore(self.max_concurrent_tasks)
+        self.scheduler = FairScheduler(
+            self.max_concurrent_tasks,
+            max_affinity_skips=config_manager.get_model_affinity_max_skips(),
+            current_model=config_manager.get_base_model()
+        )
+        # 开启自适应并发数时，由限流器根据后端的延迟、错误与显存占用调整调度器的槽位数
+        self.limiter = (
+            AdaptiveLimiter(api_client, config_manager, self.scheduler)
+            if config_manager.get_adaptive_concurrency() else None
+        )
+        self.progress_watcher = ProgressWatcher(api_client, config_manager)
+        # 流水线中不占用GPU的阶段各自限制并发
+        self.prompt_semaphore = asyncio.Semaphore(config_manager.get_prompt_concurrency())
+        self.postprocess_semaphore = asyncio.Semaphore(config_manager.get_postprocess_concurrency())
+        # 进行中的生成请求：请求参数摘要 -> SharedGeneration，用于合并相同请求
+        self._inflight = {}
+        self.jobs = JobRegistry()
+        # 会话 -> 最近一次拼合为预览图的原图，供 /sd pick 取回
+        self.pick_store = TTLCache(PICK_STORE_SIZE, config_manager.get_pick_store_ttl())
+        self.metrics.gauge("queue_depth", lambda: self.scheduler.queued, "排队中的任务")
+        self.metrics.gauge("running_tasks", lambda: self.scheduler.running, "生成中的任务")
+        self.metrics.gauge("model_switches", lambda: self.scheduler.model_switches, "模型切换次数")
+
+    @property
+    def active_tasks(self) -> int:
+        """正在执行的任务数"""
+        return self.scheduler.running
 
     def set_max_concurrent_tasks(self, max_tasks: int):
-        """设置最大并发任务数"""
+        """设置最大并发任务数，开启自适应并发数时作为并发上限"""
         self.max_concurrent_tasks = max_tasks
-        self.task_semaphore = asyncio.Semaphore(max_tasks)
-
-    async def generate_image_with_semaphore(self, event, prompt: str):
-        """使用信号量控制并发的图像生成"""
-        async with self.task_semaphore:
-            self.active_tasks += 1
-            try:
-                async for result in self._generate_image(event, prompt):
+        if self.limiter is not None:
+            self.limiter.set_bounds(self.config_manager.get_min_concurrent_tasks(), max_tasks)
+        else:
+            self.scheduler.set_capacity(max_tasks)
+
+    @staticmethod
+    def _queue_keys(event) -> tuple[str, str]:
+        """获取事件对应的调度键（群组, 用户），私聊按用户单独成组"""
+        sender_id = str(event.get_sender_id())
+        group_id = event.get_group_id()
+        group_key = f"group:{group_id}" if group_id else f"private:{sender_id}"
+        return group_key, sender_id
+
+    def _snapshot(self, event) -> ConfigSnapshot:
+        """获取本次请求的配置快照（叠加群组或用户的参数预设）"""
+        if self.preset_store is None:
+            return self.config_manager.snapshot()
+        return self.preset_store.snapshot(event)
+
+    def _resolve_model(self, event, config: ConfigSnapshot) -> str:
+        """获取本次请求使用的模型，群组或用户预设中设置的模型优先于全局的基础模型"""
+        return config.base_model
+
+    async def generate_image_with_scheduler(self, event, prompt: str, trace: Trace = None):
+        """按流水线阶段执行图像生成
+
+        提示词准备（LLM）、GPU生成与后处理各自限制并发，只有GPU生成阶段经公平调度器排队并占用槽位，
+        等待LLM或后处理的请求不会让GPU空闲。每个请求登记为一个任务，在独立的 asyncio 任务中执行，
+        以便通过 /sd cancel 取消；异步任务模式下立即返回任务ID，结果生成后再单独发送。
+        """
+        group_key, sender_key = self._queue_keys(event)
+        job = self.jobs.create(group_key, sender_key, prompt)
+        # 追踪只在任务中设为当前上下文的追踪，任务持有一份引用，结束后才导出
+        if trace is not None:
+            trace.attrs["job_id"] = job.job_id
+            trace.retain()
+
+        if self.config_manager.get_async_job_mode():
+            job.task = asyncio.ensure_future(self._run_job(job, event, prompt, trace=trace))
+            yield event.plain_result(
+                f"📨 任务已提交，任务ID：{job.job_id}\n"
+                f"使用 /sd status {job.job_id} 查看进度，/sd cancel {job.job_id} 取消任务"
+            )
+            return
+
+        results = asyncio.Queue()
+        job.task = asyncio.ensure_future(self._run_job(job, event, prompt, results, trace))
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                if self._has_image(result):
+                    with self.metrics.stage("delivery", trace):
+                        yield result
+                else:
                     yield result
-            finally:
-                self.active_tasks -= 1
-
-    async def _generate_image(self, event, prompt: str):
+        finally:
+            # 消息处理被中止时一并取消任务
+            if not job.task.done():
+                job.task.cancel()
+
+    async def _run_job(self, job: GenerationJob, event, prompt: str, results: asyncio.Queue = None,
+                       trace: Trace = None):
+        """执行任务：结果放入 results 队列（结束时放入 None），未提供队列时直接发送到会话"""
+        emit = results.put if results is not None else event.send
+        try:
+            # 任务拥有独立的上下文副本，追踪上下文只在任务内设置
+            with use_trace(trace):
+                async for result in self._generate_image(event, prompt, job):
+                    if results is None and self._has_image(result):
+                        with self.metrics.stage("delivery"):
+                            await emit(result)
+                    else:
+                        await emit(result)
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+            await emit(event.plain_result(f"🛑 任务 {job.job_id} 已取消"))
+        finally:
+            self.jobs.finish(job, "failed")
+            if trace is not None:
+                trace.attrs["state"] = job.state
+                trace.release()
+            if results is not None:
+                await results.put(None)
+
+    def cancel_job(self, job: GenerationJob) -> bool:
+        """取消任务：排队中的移出队列，生成中的在没有其他等待者时中断WebUI"""
+        if job.finished or job.task is None:
+            return False
+        job.task.cancel()
+        return True
+
+    async def shutdown(self):
+        """取消全部进行中的任务与生成调用，并等待它们结束
+
+        需要在关闭会话之前调用：被取消的生成调用会通过会话中断WebUI上仍在执行的生成。
+        """
+        tasks = [job.task for job in self.jobs.active_jobs() if job.task is not None and not job.task.done()]
+        tasks += [shared.task for shared in self._inflight.values() if not shared.task.done()]
+        if not tasks:
+            return
+        for task in tasks:
+            task.cancel()
+        _, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+        if pending:
+            logger.warning(f"插件终止时仍有 {len(pending)} 个任务未结束")
+
+    async def describe_job(self, job: GenerationJob) -> str:
+        """生成任务状态的描述文本"""
+        lines = [f"🧾 任务 {job.job_id}：{job.state_text}，已耗时 {job.elapsed:.0f} 秒"]
+        if job.state == "queued" and job.ticket is not None:
+            position = self.scheduler.position(job.ticket)
+            if position > 0:
+                lines.append(f"- 排队位置：第 {position} 位")
+        elif job.state == "running" and job.shared is not None and job.shared.call.backend is not None:
+            call = job.shared.call
+            pool = self.api_client.pool
+            if not pool.is_running(call):
+                # 进度接口只反映后端正在执行的任务，本任务仍在WebUI的队列中排队
+                lines.append(f"- 生成进度：已提交到 {call.backend.url}，正在等待前面的任务完成")
+                return "\n".join(lines)
+            try:
+                data = await self.api_client.get_progress(call.backend)
+                if pool.is_running(call):
+                    progress = data.get("progress") or 0.0
+                    eta = data.get("eta_relative") or 0.0
+                    lines.append(f"- 生成进度：{progress * 100:.0f}%，预计剩余 {eta:.0f} 秒")
+            except ConnectionError as e:
+                logger.debug(f"查询生成进度失败: {e}")
+        return "\n".join(lines)
+
+    async def _generate_image(self, event, prompt: str, job: GenerationJob):
         """核心图像生成逻辑"""
         try:
-            # 检查服务可用性
-            available, status = await self.api_client.check_availability()
-            if not available:
+            # 检查服务可用性（读取健康监测缓存的状态）
+            if not self.api_client.pool.has_available():
                 yield event.plain_result("⚠️ 同webui无连接，目前无法生成图片！")
                 return
 
-            verbose = self.config_manager.get_verbose_mode()
+            # 整个请求使用同一份配置快照，不受中途修改配置的影响
+            config = self._snapshot(event)
+            verbose = config.verbose
             if verbose:
                 yield event.plain_result("🖌️ 生成图像阶段，这可能需要一段时间...")
 
-            # 处理提示词
-            final_prompt = await self._process_prompt(prompt)
+            # 阶段一：处理提示词（可能调用LLM），不占用GPU槽位
+            job.state = "preparing"
+            async with self.prompt_semaphore:
+                with self.metrics.stage("prompt"):
+                    final_prompt = await self._process_prompt(prompt, config)
 
             # 输出正向提示词（如果启用）
-            if self.config_manager.get_show_positive_prompt():
+            if config.show_positive_prompt:
                 yield event.plain_result(f"正向提示词：{final_prompt}")
 
-            # 生成图像
-            response = await self.api_client.generate_text_to_image(final_prompt)
-            if not response.get("images"):
+            # 阶段二：生成图像，相同的进行中请求直接合并，否则经公平调度器排队
+            payload = self.api_client.build_generation_payload(final_prompt, config)
+            key = self._payload_key(payload, config.base_model)
+            images = await self._lookup_cache(payload, key)
+            if images is None:
+                shared = self._inflight.get(key)
+                if shared is None:
+                    ticket = self.scheduler.submit(job.group_key, job.sender_key, self._resolve_model(event, config))
+                    job.state = "queued"
+                    job.ticket = ticket
+                    handed_over = False
+                    try:
+                        position = self.scheduler.position(ticket)
+                        if position > 0:
+                            yield event.plain_result(f"⏳ 已加入生成队列，当前排在第 {position} 位")
+                        with self.metrics.stage("queue_wait"):
+                            await self.scheduler.wait(ticket)
+
+                        # 排队期间可能已有相同请求开始生成
+                        shared = self._inflight.get(key)
+                        if shared is None:
+                            # 调度器保证切换模型时没有其他模型的任务在运行
+                            if not await self.api_client.ensure_model(ticket.model):
+                                yield event.plain_result("⚠️ 切换模型失败，请检查 WebUI 状态")
+                                return
+                            shared = self._start_generation(payload, key, ticket)
+                            handed_over = True
+                    finally:
+                        # 槽位交给生成任务后，由任务结束时归还
+                        if not handed_over:
+                            self.scheduler.release(ticket)
+
+                images = None
+                async for result in self._await_shared(event, shared, job, verbose):
+                    if isinstance(result, list):
+                        images = result
+                    else:
+                        yield result
+            if not images:
                 raise ValueError("API返回数据异常：生成图像失败")
 
-            # 处理图像结果
-            async for result in self._process_generated_images(event, response["images"], verbose):
-                yield result
+            # 阶段三：后处理（图像增强等），不占用GPU生成槽位
+            if config.upscale_enabled and verbose:
+                yield event.plain_result("🖼️ 处理图像阶段，即将结束...")
+            job.state = "postprocessing"
+            platform = self._platform_name(event)
+            async with self.postprocess_semaphore:
+                chain = await self._build_contact_sheet(event, images, config, platform)
+                if chain is None:
+                    chain = await self._build_result_chain(images, config, platform)
+            yield event.chain_result(chain)
+            job.state = "done"
 
             if verbose:
                 yield event.plain_result("✅ 图像生成成功")
@@ -84,77 +304,264 @@ class ImageProcessor:
             logger.error(f"生成图像时发生其他错误: {e}")
             yield event.plain_result(f"❌ 图像生成失败: 发生其他错误，请检查日志")
 
-    async def _process_prompt(self, prompt: str) -> str:
+    async def _process_prompt(self, prompt: str, config: ConfigSnapshot) -> str:
         """处理提示词，包括生成和格式化"""
-        if self.config_manager.get_generate_prompt_enabled():
+        if config.generate_prompt:
             generated_prompt = await self._generate_prompt_with_llm(prompt)
             logger.debug(f"LLM generated prompt: {generated_prompt}")
 
             # 添加全局正面提示词
-            positive_prompt = self._combine_with_global_positive_prompt(generated_prompt)
+            positive_prompt = config.combine_with_global_positive_prompt(generated_prompt)
             return positive_prompt
         else:
             # 使用用户提供的提示词
-            user_prompt = self._trans_prompt(prompt)
-            positive_prompt = self._combine_with_global_positive_prompt(user_prompt)
+            user_prompt = config.trans_prompt(prompt)
+            positive_prompt = config.combine_with_global_positive_prompt(user_prompt)
             return positive_prompt
 
-    def _trans_prompt(self, prompt: str) -> str:
-        """将提示词中的空格替换字符替换为空格"""
-        replace_space = self.config_manager.get_replace_space_char()
-        return prompt.replace(replace_space, " ")
-
-    def _combine_with_global_positive_prompt(self, prompt: str) -> str:
-        """将提示词与全局正面提示词组合"""
-        global_positive = self.config_manager.get_positive_prompt_global()
-        add_to_head = self.config_manager.get_positive_prompt_add_position()
-
-        if add_to_head:
-            return global_positive + prompt
-        else:
-            return prompt + global_positive
+    @staticmethod
+    def _payload_key(payload: dict, model: str) -> str:
+        """计算生成请求的唯一键（请求参数 + 基础模型）"""
+        material = {"payload": payload, "model": model}
+        encoded = json.dumps(material, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _is_cacheable(self, payload: dict) -> bool:
+        """仅固定种子的请求结果是确定的，才可以缓存"""
+        return (
+            self.result_cache is not None
+            and self.result_cache.enabled
+            and payload.get("seed", -1) != -1
+        )
+
+    async def _lookup_cache(self, payload: dict, key: str):
+        """读取结果缓存，未命中或不可缓存时返回 None"""
+        if not self._is_cacheable(payload):
+            return None
+        images = await self.result_cache.get(key)
+        if images:
+            logger.debug(f"结果缓存命中: {key}")
+            # 缓存读出的图像在内存中，同样写入暂存区，避免长期持有（例如保存在 pick_store 中）
+            images = [await self._spill(record) for record in images]
+        return images
+
+    async def _generate_and_store(self, payload: dict, key: str, call: BackendCall) -> list:
+        """调用WebUI生成图像，每张图像到达后立即写入暂存区，并将确定性结果写入缓存"""
+        images = []
+        start = time.perf_counter()
+        try:
+            with self.metrics.stage("txt2img"):
+                async for record in self.api_client.stream_text_to_image(payload, call):
+                    images.append(await self._spill(record))
+        except Exception as e:
+            self._record_generation(payload, start, e)
+            raise
+        self._record_generation(payload, start)
+        self.metrics.inc("images_generated_total", len(images))
+        if self._is_cacheable(payload) and images:
+            await self.result_cache.put(key, images)
+        return images
+
+    def _record_generation(self, payload: dict, start: float, error: Exception = None):
+        """将生成请求的耗时与错误反馈给自适应限流器（被取消的请求不计入）"""
+        if self.limiter is not None:
+            self.limiter.record(payload, time.perf_counter() - start, error)
+
+    def _start_generation(self, payload: dict, key: str, ticket: Ticket) -> SharedGeneration:
+        """发起生成任务并登记为进行中，相同参数的后续请求会合并到该任务；任务结束时归还调度槽位"""
+        if self.limiter is not None:
+            self.limiter.start()
+        call = BackendCall()
+        task = asyncio.ensure_future(self._generate_and_store(payload, key, call))
+        shared = SharedGeneration(task, call)
+        self._inflight[key] = shared
+        task.add_done_callback(lambda t: self._on_generation_done(key, t))
+        task.add_done_callback(lambda _: self.scheduler.release(ticket))
+        return shared
+
+    async def _await_shared(self, event, shared: SharedGeneration, job: GenerationJob, verbose: bool):
+        """等待共享的生成任务，期间产出进度消息，最后产出图像记录列表
+
+        所有等待者都被取消时取消生成任务，客户端会随之中断WebUI上正在执行的生成，释放GPU。
+        """
+        job.state = "running"
+        job.shared = shared
+        shared.waiters += 1
+        try:
+            if verbose:
+                async for result in self.progress_watcher.watch(event, shared.task, shared.call):
+                    yield result
+            # 使用 shield 保证单个请求方被取消时不影响合并到同一任务的其他等待者
+            yield await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            if shared.waiters == 0 and not shared.task.done():
+                shared.task.cancel()
+
+    def _on_generation_done(self, key: str, task: asyncio.Task):
+        """生成任务结束后移出进行中列表"""
+        shared = self._inflight.get(key)
+        if shared is not None and shared.task is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 标记异常已被读取，避免所有等待者都被取消时产生未处理异常的警告
+            task.exception()
 
     async def _generate_prompt_with_llm(self, prompt: str) -> str:
         """使用LLM生成提示词"""
         # 这个方法将在主类中被LLM工具的实际方法替换
         return ""
 
-    async def _process_generated_images(self, event, images: list, verbose: bool):
-        """处理生成的图像"""
-        upscale_enabled = self.config_manager.get_upscale_enabled()
-
-        if upscale_enabled and verbose:
-            yield event.plain_result("🖼️ 处理图像阶段，即将结束...")
+    async def _build_result_chain(self, images: list, config: ConfigSnapshot, platform: str = "") -> list:
+        """将生成的图像处理为消息组件列表"""
+        source = self._upscale_images(images, config) if config.upscale_enabled else self._iter_records(images)
 
+        # 每张图像放大完成后立即开始编码，结果按完成顺序返回，发送时恢复原始顺序
+        encoding = {}
+        try:
+            async for record in source:
+                encoding[record.index] = asyncio.ensure_future(self._finalize(record, config, platform))
+            # 批量放大返回的图像少于发送的图像时，缺少的图像发送放大前的原图
+            missing = [record for record in images if record.index not in encoding]
+            if missing:
+                logger.warning(f"批量放大缺少 {len(missing)} 张图像的结果，改为发送原图")
+            for record in missing:
+                encoding[record.index] = asyncio.ensure_future(self._finalize(record, config, platform))
+            records = await asyncio.gather(*(encoding[record.index] for record in images))
+        finally:
+            for task in encoding.values():
+                task.cancel()
+        return [self._to_component(record) for record in records]
+
+    async def _build_contact_sheet(self, event, images: list, config: ConfigSnapshot, platform: str = ""):
+        """图像数达到阈值时拼合为一张带序号的预览图并暂存原图，返回消息组件列表；不拼合时返回 None"""
+        threshold = config.contact_sheet_threshold
+        if not threshold or len(images) < threshold:
+            return None
+        if self.image_encoder is None or not self.image_encoder.can_compose:
+            # 未安装 Pillow 的提示已在编码器创建时输出一次
+            logger.debug("无法拼合预览图，将逐张发送")
+            return None
+
+        sheet = await self.image_encoder.compose_contact_sheet(images, config)
+        if sheet is None:
+            return None
+        group_key, _ = self._queue_keys(event)
+        self.pick_store.set(group_key, images)
+
+        from astrbot.api.all import Plain
+        sheet = await self._finalize(sheet, config, platform)
+        return [
+            Plain(f"🗂️ 共 {len(images)} 张图像，发送 /sd pick 序号 取回原图（多个序号用英文逗号分隔）"),
+            self._to_component(sheet)
+        ]
+
+    async def pick_images(self, event, indices: list):
+        """从本会话最近一次的预览图中取回指定序号（从 1 开始）的原图
+
+        返回消息组件列表；预览图已过期时返回 None，序号都无效时返回空列表。
+        """
+        group_key, _ = self._queue_keys(event)
+        images = self.pick_store.get(group_key)
+        if images is None:
+            return None
+        selected = [images[index - 1] for index in dict.fromkeys(indices) if 1 <= index <= len(images)]
+        if not selected:
+            return []
+        # 原图可能已被暂存区按保留时间清理，此时按预览图已过期处理
+        paths = [record.path for record in selected if record.path is not None]
+        if paths and not all(await asyncio.to_thread(lambda: [os.path.exists(path) for path in paths])):
+            self.pick_store.invalidate(group_key)
+            return None
+        async with self.postprocess_semaphore:
+            return await self._build_result_chain(
+                selected, self._snapshot(event), self._platform_name(event)
+            )
+
+    @staticmethod
+    async def _iter_records(images: list):
+        for record in images:
+            yield record
+
+    async def _finalize(self, record: ImageRecord, config: ConfigSnapshot, platform: str) -> ImageRecord:
+        """编码待发送的图像并写入暂存区"""
+        return await self._spill(await self._encode(record, config, platform))
+
+    async def _spill(self, record: ImageRecord) -> ImageRecord:
+        """将图像写入暂存区，未配置暂存区时原样返回"""
+        if self.image_spool is None:
+            return record
+        return await self.image_spool.spill(record)
+
+    async def _encode(self, record: ImageRecord, config: ConfigSnapshot, platform: str) -> ImageRecord:
+        """按配置快照中的输出编码设置处理单张图像"""
+        if self.image_encoder is None or config.output_format == "original":
+            return record
+        with self.metrics.stage("encode"):
+            return await self.image_encoder.encode(record, config, platform)
+
+    @staticmethod
+    def _has_image(result) -> bool:
+        """消息结果中是否包含图像，用于统计图像发送耗时"""
+        return any(type(component).__name__ == "Image" for component in getattr(result, "chain", None) or ())
+
+    @staticmethod
+    def _platform_name(event) -> str:
+        """获取消息所属的平台名，用于选择对应的图像大小上限"""
+        try:
+            return event.get_platform_name()
+        except Exception:
+            return ""
+
+    async def _upscale_images(self, images: list, config: ConfigSnapshot):
+        """放大一组图像，按完成顺序逐张产出放大后的图像记录，并统计整批放大的耗时"""
+        with self.metrics.stage("upscale"):
+            async for record in self._upscale_records(images, config):
+                yield record
+
+    async def _upscale_records(self, images: list, config: ConfigSnapshot):
+        """放大一组图像，按完成顺序逐张产出放大后的图像记录"""
+        upscale_payload = config.build_upscale_payload()
         if len(images) == 1:
-            # 单张图像处理
-            image = await self._process_single_image(images[0], upscale_enabled)
-            yield event.chain_result([image])
-        else:
-            # 多张图像处理
-            chain = []
-            for image_data in images:
-                image = await self._process_single_image(image_data, upscale_enabled)
-                chain.append(image)
-            yield event.chain_result(chain)
+            yield await self.api_client.process_image_upscale(images[0], upscale_payload)
+            return
+
+        if config.upscale_mode == "batch":
+            # 整批图像通过一次请求放大
+            async for record in self.api_client.stream_batch_upscale(images, upscale_payload):
+                yield record
+            return
 
-    async def _process_single_image(self, image_data: str, apply_upscale: bool) -> object:
-        """处理单张图像"""
-        # 解码base64图像数据
-        image_bytes = base64.b64decode(image_data)
-        image_base64 = base64.b64encode(image_bytes).decode("utf-8")
+        # 并发逐张放大，同时进行的请求数受限
+        semaphore = asyncio.Semaphore(config.upscale_concurrency)
 
-        # 应用图像增强（如果启用）
-        if apply_upscale:
-            image_base64 = await self.api_client.process_image_upscale(image_base64)
+        async def upscale(record):
+            async with semaphore:
+                return await self.api_client.process_image_upscale(record, upscale_payload)
 
-        # 返回图像对象（根据AstrBot的API）
+        tasks = [asyncio.ensure_future(upscale(record)) for record in images]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _to_component(record: ImageRecord) -> object:
+        """将图像记录转换为消息组件（根据AstrBot的API），已写入暂存区的图像按文件路径发送"""
         from astrbot.api.all import Image
-        return Image.fromBase64(image_base64)
+        if record.path is not None:
+            return Image.fromFileSystem(record.path)
+        return Image.fromBase64(record.base64)
 
     def get_task_status(self) -> dict:
         """获取当前任务状态"""
         return {
+            "jobs": len(self.jobs.active_jobs()),
             "active_tasks": self.active_tasks,
-            "max_concurrent_tasks": self.max_concurrent_tasks
+            "queued_tasks": self.scheduler.queued,
+            "model_switches": self.scheduler.model_switches,
+            "max_concurrent_tasks": self.max_concurrent_tasks,
+            "concurrency_limit": self.scheduler.capacity
         }
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""图像记录模块，定义在生成流水线中传递的单张图像"""
+
+import asyncio
+import base64
+import os
+
+
+class ImageRecord:
+    """流水线中的单张图像
+
+    图像以收到时的形式保存（WebUI 返回的 base64 文本，或磁盘/缓存中的原始字节），
+    另一种形式只在第一次被需要时转换一次并复用，避免在各阶段之间反复编解码。
+    写入暂存区的图像只保存文件路径，需要时才从磁盘读取，且不在内存中保留；
+    在事件循环中应使用 read / read_base64，在线程中读取文件。
+    """
+
+    __slots__ = ("index", "upscaled", "path", "_data", "_base64")
+
+    def __init__(self, data: bytes = None, base64_data: str = None, index: int = 0, upscaled: bool = False,
+                 path: str = None):
+        if data is None and base64_data is None and path is None:
+            raise ValueError("图像记录需要原始字节、base64数据或文件路径")
+        self.index = index
+        self.upscaled = upscaled
+        self.path = path
+        self._data = data
+        self._base64 = base64_data
+
+    @property
+    def data(self) -> bytes:
+        """图像原始字节"""
+        if self._data is not None:
+            return self._data
+        if self._base64 is None:
+            return self._read_file()
+        self._data = base64.b64decode(self._base64)
+        return self._data
+
+    @property
+    def base64(self) -> str:
+        """图像的base64文本"""
+        if self._base64 is not None:
+            return self._base64
+        if self._data is None:
+            return base64.b64encode(self.data).decode("ascii")
+        self._base64 = base64.b64encode(memoryview(self._data)).decode("ascii")
+        return self._base64
+
+    def _read_file(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    async def read(self) -> bytes:
+        """读取图像原始字节，只保存文件路径的图像在线程中读取，不阻塞事件循环"""
+        if self._data is None and self._base64 is None:
+            return await asyncio.to_thread(self._read_file)
+        return self.data
+
+    async def read_base64(self) -> str:
+        """读取图像的base64文本，只保存文件路径的图像在线程中读取并编码"""
+        if self._data is None and self._base64 is None:
+            return await asyncio.to_thread(lambda: base64.b64encode(self._read_file()).decode("ascii"))
+        return self.base64
+
+    def view(self) -> memoryview:
+        """图像原始字节的只读视图"""
+        return memoryview(self.data)
+
+    @property
+    def size(self) -> int:
+        """图像字节数（未解码时按base64长度估算）"""
+        if self._data is not None:
+            return len(self._data)
+        if self._base64 is not None:
+            return len(self._base64) * 3 // 4
+        return os.path.getsize(self.path)
+
+    def __repr__(self) -> str:
+        return f"ImageRecord(index={self.index}, size={self.size}, upscaled={self.upscaled})"
@@ -0,0 +1,127 @@
+"""图像暂存模块，将生成的图像写入磁盘，以文件路径在流水线中传递与发送"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+from .image_record import ImageRecord
+
+logger = logging.getLogger(__name__)
+
+# 清理任务的运行间隔（秒）
+JANITOR_INTERVAL = 60
+# 超出容量时也不会清理的最短保留时间（秒），避免删除仍在排队或发送中的图像
+MIN_RETENTION = 300
+
+
+def guess_extension(data: bytes) -> str:
+    """根据文件头判断图像格式对应的扩展名"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    return ".png"
+
+
+class ImageSpool:
+    """图像暂存区
+
+    图像到达后立即解码写入 spool_dir，之后只以路径的形式保存在图像记录中，
+    进程内存占用不再随排队或发送中的图像数量增长。后台清理任务会删除超过
+    max_age 的文件，并在总大小超过 max_bytes 时按从旧到新的顺序删除，
+    但不会删除写入不足 min_retention 秒的文件（仍可能被 /sd pick 引用的原图需要保留）。
+    """
+
+    def __init__(self, spool_dir: str, max_bytes: int, max_age: float, min_retention: float = MIN_RETENTION):
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_retention = min(max(MIN_RETENTION, min_retention), max_age)
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用暂存"""
+        return self.max_bytes > 0
+
+    def start(self):
+        """启动后台清理任务（需在事件循环中调用，重复调用无副作用）"""
+        if self._task and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        """停止后台清理任务"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def _write(self, record: ImageRecord) -> str:
+        # 在工作线程中读取 data，base64 解码也不占用事件循环
+        data = record.data
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex}{guess_extension(data)}")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    async def spill(self, record: ImageRecord) -> ImageRecord:
+        """将图像写入暂存区，返回只保存路径的图像记录；未启用或写入失败时返回原记录"""
+        if not self.enabled or record.path is not None:
+            return record
+        self.start()
+        try:
+            path = await asyncio.to_thread(self._write, record)
+        except OSError as e:
+            logger.warning(f"写入图像暂存区失败: {e}")
+            return record
+        return ImageRecord(path=path, index=record.index, upscaled=record.upscaled)
+
+    async def _run(self):
+        """按固定间隔清理暂存区"""
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"清理图像暂存区异常: {e}")
+            await asyncio.sleep(JANITOR_INTERVAL)
+
+    def sweep(self) -> int:
+        """删除过期文件，并按容量从旧到新删除，返回删除的文件数"""
+        if not os.path.isdir(self.spool_dir):
+            return 0
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.spool_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        files.sort()
+
+        total = sum(size for _, _, size in files)
+        removed = 0
+        for mtime, path, size in files:
+            age = now - mtime
+            if age <= self.max_age and (total <= self.max_bytes or age < self.min_retention):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logger.debug(f"图像暂存区清理了 {removed} 个文件，剩余 {total} 字节")
+        return removed
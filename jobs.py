@@ -0,0 +1,94 @@
+"""任务管理模块，记录生成任务的状态，支持查询与取消"""
+
+import itertools
+import time
+from collections import OrderedDict
+
+# 任务状态及其展示文本
+JOB_STATES = {
+    "preparing": "准备提示词",
+    "queued": "排队中",
+    "running": "生成中",
+    "postprocessing": "后处理中",
+    "done": "已完成",
+    "failed": "失败",
+    "cancelled": "已取消",
+}
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+class SharedGeneration:
+    """一次WebUI生成调用，相同参数的多个任务共享同一次调用"""
+
+    def __init__(self, task, call):
+        self.task = task
+        self.call = call
+        self.waiters = 0
+
+
+class GenerationJob:
+    """一次生成请求"""
+
+    def __init__(self, job_id: str, group_key: str, sender_key: str, prompt: str):
+        self.job_id = job_id
+        self.group_key = group_key
+        self.sender_key = sender_key
+        self.prompt = prompt
+        self.state = "preparing"
+        self.created_at = time.monotonic()
+        self.finished_at = None
+        # 执行该请求的 asyncio 任务，取消请求即取消该任务
+        self.task = None
+        self.ticket = None
+        self.shared = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    @property
+    def state_text(self) -> str:
+        return JOB_STATES.get(self.state, self.state)
+
+    @property
+    def elapsed(self) -> float:
+        """任务已耗时（秒）"""
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.created_at
+
+
+class JobRegistry:
+    """任务注册表，保存进行中的任务与最近结束的任务"""
+
+    def __init__(self, max_finished: int = 100):
+        self.max_finished = max_finished
+        self._ids = itertools.count(1)
+        self._active = {}
+        self._finished = OrderedDict()
+
+    def create(self, group_key: str, sender_key: str, prompt: str) -> GenerationJob:
+        """登记一个新任务"""
+        job = GenerationJob(str(next(self._ids)), group_key, sender_key, prompt)
+        self._active[job.job_id] = job
+        return job
+
+    def get(self, job_id: str):
+        """按ID查找任务，不存在时返回 None"""
+        return self._active.get(job_id) or self._finished.get(job_id)
+
+    def active_jobs(self, sender_key: str = None) -> list:
+        """列出进行中的任务，可按用户筛选"""
+        return [
+            job for job in self._active.values()
+            if sender_key is None or job.sender_key == sender_key
+        ]
+
+    def finish(self, job: GenerationJob, state: str):
+        """将任务标记为结束，并只保留最近的若干条结束记录"""
+        if not job.finished:
+            job.state = state
+        job.finished_at = time.monotonic()
+        self._active.pop(job.job_id, None)
+        self._finished[job.job_id] = job
+        while len(self._finished) > self.max_finished:
+            self._finished.popitem(last=False)
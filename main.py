@@ -3,10 +3,28 @@ import logging
 
 from astrbot.api.all import *
 
-from . import ConfigManager, SDWebUIClient, ResourceManager, ImageProcessor, CommandHandlers, LLMTools
+from . import (
+    ConfigManager, SDWebUIClient, ResourceManager, ImageProcessor, CommandHandlers, LLMTools, ResultCache,
+    ImageEncoder, ImageSpool, PresetStore, Metrics, MetricsExporter, Tracer
+)
+from .tracing import install_log_filter
 
 logger = logging.getLogger(__name__)
 TEMP_PATH = os.path.abspath("data/temp")
+# 需要长期保存的插件数据（参数预设等），不放在会被清理的临时目录中
+DATA_PATH = os.path.abspath("data/plugin_data/astrbot_plugin_SDGen_SunQAQ")
+
+
+def data_file(name: str) -> str:
+    """获取插件数据文件的路径，旧版本保存在临时目录中的文件会被移动过来"""
+    path = os.path.join(DATA_PATH, name)
+    legacy = os.path.join(TEMP_PATH, name)
+    if not os.path.exists(path) and os.path.exists(legacy):
+        try:
+            os.replace(legacy, path)
+        except OSError as e:
+            logger.warning(f"迁移 {legacy} 失败: {e}")
+    return path
 
 
 @register("SDGen", "buding(AstrBot)", "Stable Diffusion图像生成器", "1.1.2")
@@ -17,18 +35,48 @@ class SDGenerator(Star):
         super().__init__(context)
         self.config = config
         os.makedirs(TEMP_PATH, exist_ok=True)
+        os.makedirs(DATA_PATH, exist_ok=True)
 
         # 初始化各个模块
         self.config_manager = ConfigManager(config)
-        self.api_client = SDWebUIClient(self.config_manager)
+        self.metrics = Metrics()
+        self.api_client = SDWebUIClient(self.config_manager, self.metrics)
+        self.metrics_exporter = MetricsExporter(
+            self.metrics,
+            self.config_manager.get_metrics_file(),
+            self.config_manager.get_metrics_port()
+        )
         self.resource_manager = ResourceManager(self.api_client, self.config_manager)
-        self.image_processor = ImageProcessor(self.api_client, self.config_manager)
-        self.command_handlers = CommandHandlers(self.config_manager, self.image_processor, self.resource_manager)
-        self.llm_tools = LLMTools(context, self.config_manager)
+        self.result_cache = ResultCache(
+            os.path.join(TEMP_PATH, "result_cache"),
+            self.config_manager.get_result_cache_max_bytes()
+        )
+        self.image_encoder = ImageEncoder(self.config_manager)
+        self.image_spool = ImageSpool(
+            os.path.join(TEMP_PATH, "spool"),
+            self.config_manager.get_spool_max_bytes(),
+            self.config_manager.get_spool_max_age(),
+            # 超出容量时也保留 /sd pick 仍可能引用的原图
+            self.config_manager.get_pick_store_ttl()
+        )
+        self.preset_store = PresetStore(self.config_manager, data_file("presets.json"))
+        self.image_processor = ImageProcessor(
+            self.api_client, self.config_manager, self.result_cache, self.image_encoder, self.image_spool,
+            self.preset_store
+        )
+        self.tracer = Tracer(self.config_manager, os.path.join(TEMP_PATH, "traces.jsonl"))
+        install_log_filter(__package__)
+        self.command_handlers = CommandHandlers(
+            self.config_manager, self.image_processor, self.resource_manager, self.preset_store, self.tracer
+        )
+        prompt_cache_path = (
+            data_file("prompt_cache.jsonl")
+            if self.config_manager.get_prompt_cache_persist() else None
+        )
+        self.llm_tools = LLMTools(context, self.config_manager, prompt_cache_path)
 
         # 设置最大并发任务数
-        max_tasks = config.get("max_concurrent_tasks", 10)
-        self.image_processor.set_max_concurrent_tasks(max_tasks)
+        self.image_processor.set_max_concurrent_tasks(self.config_manager.get_max_concurrent_tasks())
 
         # 配置验证
         self.config_manager.validate_config()
@@ -39,10 +87,29 @@ class SDGenerator(Star):
         # 为LLM工具注入图像生成功能
         self.llm_tools.llm_tool_generate_image = self._llm_tool_generate_image
 
+    async def initialize(self):
+        """插件初始化完成后启动后台任务"""
+        self.metrics_exporter.start()
+
     async def terminate(self):
         """插件终止时清理资源"""
+        if self.image_processor:
+            # 先取消并等待进行中的任务，被取消的生成需要会话来中断WebUI
+            await self.image_processor.shutdown()
+        if self.config_manager:
+            await self.config_manager.flush()
+        if self.metrics_exporter:
+            await self.metrics_exporter.stop()
+        if self.preset_store:
+            await self.preset_store.flush()
+        if self.image_processor and self.image_processor.limiter:
+            await self.image_processor.limiter.stop()
         if self.api_client:
             await self.api_client.close_session()
+        if self.image_encoder:
+            self.image_encoder.shutdown()
+        if self.image_spool:
+            await self.image_spool.stop()
 
     # 基础命令组
     @command_group("sd")
@@ -59,9 +126,36 @@ class SDGenerator(Star):
     @sd.command("gen")
     async def generate_image(self, event: AstrMessageEvent, prompt: str):
         """生成图像指令"""
+        # 插件框架未调用 initialize 时，在首次处理请求时启动指标导出
+        self.metrics_exporter.start()
         async for result in self.command_handlers.handle_gen(event, prompt):
             yield result
 
+    @sd.command("status")
+    async def job_status(self, event: AstrMessageEvent, job_id: str = ""):
+        """查询任务状态"""
+        async for result in self.command_handlers.handle_status(event, job_id):
+            yield result
+
+    @sd.command("cancel")
+    async def cancel_job(self, event: AstrMessageEvent, job_id: str = ""):
+        """取消任务"""
+        async for result in self.command_handlers.handle_cancel(event, job_id):
+            yield result
+
+    @sd.command("stats")
+    async def show_stats(self, event: AstrMessageEvent):
+        """查看运行统计"""
+        self.metrics_exporter.start()
+        async for result in self.command_handlers.handle_stats(event):
+            yield result
+
+    @sd.command("pick")
+    async def pick_images(self, event: AstrMessageEvent, indices: str = ""):
+        """从网格预览图中取回原图"""
+        async for result in self.command_handlers.handle_pick(event, indices):
+            yield result
+
     @sd.command("verbose")
     async def set_verbose(self, event: AstrMessageEvent):
         """切换详细输出模式"""
@@ -129,6 +223,12 @@ class SDGenerator(Star):
         async for result in self.command_handlers.handle_n_iter(event, n_iter):
             yield result
 
+    @sd.command("reset")
+    async def reset_params(self, event: AstrMessageEvent):
+        """清除群组或用户的预设参数"""
+        async for result in self.command_handlers.handle_reset_params(event):
+            yield result
+
     # 模型管理命令组
     @sd.group("model")
     def model(self):
@@ -159,6 +259,12 @@ class SDGenerator(Star):
         async for result in self.command_handlers.handle_embedding_list(event):
             yield result
 
+    @sd.command("refresh")
+    async def refresh_resources(self, event: AstrMessageEvent):
+        """刷新资源列表缓存"""
+        async for result in self.command_handlers.handle_refresh(event):
+            yield result
+
     # 采样器命令组
     @sd.group("sampler")
     def sampler(self):
@@ -197,9 +303,13 @@ class SDGenerator(Star):
     @llm_tool("generate_image")
     async def _llm_tool_generate_image(self, event: AstrMessageEvent, prompt: str):
         """LLM工具：根据提示词生成图像"""
+        self.metrics_exporter.start()
+        trace = self.tracer.start("llm_tool.generate_image", sender=str(event.get_sender_id()))
         try:
-            async for result in self.image_processor.generate_image_with_semaphore(event, prompt):
+            async for result in self.image_processor.generate_image_with_scheduler(event, prompt, trace):
                 yield result
         except Exception as e:
             logger.error(f"调用 generate_image 时出错: {e}")
-            yield event.plain_result("❌ 图像生成失败，请检查日志")
\ No newline at end of file
+            yield event.plain_result("❌ 图像生成失败，请检查日志")
+        finally:
+            trace.release()
\ No newline at end of file
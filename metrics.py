@@ -0,0 +1,269 @@
+"""指标模块，统计各流水线阶段的耗时、吞吐与错误，并提供 Prometheus 文本格式的导出"""
+
+import asyncio
+import bisect
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 流水线阶段及其展示名称
+STAGES = {
+    "prompt": "提示词",
+    "availability": "可用性探测",
+    "queue_wait": "排队等待",
+    "txt2img": "文生图",
+    "upscale": "图像放大",
+    "encode": "输出编码",
+    "delivery": "消息发送",
+}
+
+
+def _format_labels(labels, extra=()) -> str:
+    """将标签格式化为 Prometheus 文本格式，并转义标签值中的反斜杠、引号与换行"""
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    pairs = []
+    for name, value in items:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """按分桶线性插值估算分位数"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """指标注册表
+
+    直方图与计数器按（名称, 标签）保存，仪表盘指标在导出时通过回调读取当前值。
+    所有更新都在事件循环中进行，不需要加锁。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}  # (name, labels) -> float
+        self._gauges = {}  # name -> (回调, 展示名称)
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        """记录一次观测值"""
+        key = self._key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """增加计数"""
+        key = self._key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name: str, callback, label: str = ""):
+        """注册仪表盘指标，callback 返回当前值"""
+        self._gauges[name] = (callback, label or name)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """统计代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, stage: str, trace=None):
+        """统计流水线阶段的耗时，并在当前追踪（或显式传入的 trace）中记录为一个阶段"""
+        with span(stage, trace), self.timer("stage_seconds", stage=stage):
+            yield
+
+    def histogram(self, name: str, **labels):
+        """获取直方图，不存在时返回 None"""
+        return self._histograms.get(self._key(name, labels))
+
+    def counters(self, name: str) -> dict:
+        """获取同名计数器按标签的取值"""
+        return {labels: value for (key, labels), value in self._counters.items() if key == name}
+
+    def summary(self) -> str:
+        """生成用于聊天回复的统计摘要"""
+        uptime = time.time() - self.started_at
+        lines = [f"📊 运行 {uptime / 3600:.1f} 小时的统计"]
+
+        lines.append("⏱️ 阶段耗时（次数 / 平均 / p50 / p95）:")
+        for stage, label in STAGES.items():
+            histogram = self.histogram("stage_seconds", stage=stage)
+            if histogram is None or histogram.count == 0:
+                continue
+            lines.append(
+                f"- {label}: {histogram.count} 次 / {histogram.sum / histogram.count:.2f}s / "
+                f"{histogram.quantile(0.5):.2f}s / {histogram.quantile(0.95):.2f}s"
+            )
+
+        if self._gauges:
+            lines.append("📈 当前状态:")
+        for name, (callback, label) in self._gauges.items():
+            try:
+                lines.append(f"- {label}: {callback()}")
+            except Exception as e:
+                logger.debug(f"读取指标 {name} 失败: {e}")
+
+        requests = self.counters("backend_requests_total")
+        if requests:
+            errors = self.counters("backend_errors_total")
+            transferred = self.counters("backend_bytes_total")
+            lines.append("🖥️ 后端（请求 / 错误 / 传输）:")
+            for labels, count in sorted(requests.items()):
+                backend = dict(labels)["backend"]
+                error_count = sum(v for k, v in errors.items() if dict(k)["backend"] == backend)
+                size = transferred.get(labels, 0) / 1024 / 1024
+                lines.append(f"- {backend}: {count:.0f} / {error_count:.0f} / {size:.1f}MB")
+        return "\n".join(lines)
+
+    def render_prometheus(self, prefix: str = "sdgen_") -> str:
+        """以 Prometheus 文本格式导出全部指标"""
+        lines = []
+        for name in sorted({name for name, _ in self._counters}):
+            lines.append(f"# TYPE {prefix}{name} counter")
+            for (key, labels), value in sorted(self._counters.items()):
+                if key == name:
+                    lines.append(f"{prefix}{name}{_format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in self._histograms}):
+            lines.append(f"# TYPE {prefix}{name} histogram")
+            for (key, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{prefix}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{prefix}{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{prefix}{name}_count{_format_labels(labels)} {histogram.count}")
+
+        for name, (callback, _) in sorted(self._gauges.items()):
+            try:
+                value = callback()
+            except Exception:
+                continue
+            lines.append(f"# TYPE {prefix}{name} gauge")
+            lines.append(f"{prefix}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Prometheus 指标导出器：定期写入文本文件（供 node_exporter 的 textfile 收集器读取），
+    或在本地端口上提供 /metrics 接口"""
+
+    def __init__(self, metrics: Metrics, file_path: str = "", port: int = 0, interval: float = 15):
+        self.metrics = metrics
+        self.file_path = file_path
+        self.port = port
+        self.interval = interval
+        self._task = None
+        self._runner = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.file_path) or self.port > 0
+
+    def start(self):
+        """启动后台导出任务（需在事件循环中调用，重复调用无副作用）"""
+        if not self.enabled or (self._task and not self._task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("当前没有运行中的事件循环，指标导出将在首次处理请求时启动")
+            return
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        """停止导出"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _serve(self):
+        """在本地端口上提供 /metrics 接口"""
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.metrics.render_prometheus(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        logger.info(f"指标导出接口已启动: http://127.0.0.1:{self.port}/metrics")
+
+    def _write(self, content: str):
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, self.file_path)
+
+    async def _run(self):
+        if self.port > 0:
+            try:
+                await self._serve()
+            except OSError as e:
+                logger.error(f"启动指标导出接口失败: {e}")
+        if not self.file_path:
+            return
+        while True:
+            try:
+                await asyncio.to_thread(self._write, self.metrics.render_prometheus())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"写入指标文件失败: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,105 @@
+"""持久化模块，合并短时间内的多次配置修改，在后台线程中原子地写入磁盘"""
+
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# 合并写入的等待时间（秒）
+DEFAULT_SAVE_DELAY = 1.0
+# 写入失败后重试的最长等待时间（秒），每次失败等待时间加倍
+MAX_RETRY_DELAY = 300.0
+
+
+class DebouncedWriter:
+    """延迟合并的配置写入器
+
+    修改配置后调用 schedule()，等待 delay 秒内的后续修改一并写入，
+    避免多个管理员同时调整参数时在事件循环上产生一连串阻塞的磁盘写入。
+    写入先生成临时文件再通过 os.replace 替换，进程中途退出也不会留下损坏的配置文件。
+    写入路径默认取配置对象的 config_path，都没有时退回为在线程中调用其 save_config()。
+    写入失败时修改保留在内存中，并以指数退避的间隔在后台重试。
+    """
+
+    def __init__(self, config, delay: float = DEFAULT_SAVE_DELAY, path: str = None):
+        self.config = config
+        self.delay = delay
+        self.path = path or getattr(config, "config_path", None)
+        self.writes = 0
+        self.failures = 0
+        self._dirty = False
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def pending(self) -> bool:
+        """是否有尚未写入的修改"""
+        return self._dirty
+
+    def schedule(self):
+        """标记配置已修改，在等待时间结束后写入；没有运行中的事件循环时立即同步写入"""
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._serialize())
+            self._dirty = False
+            return
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self, delay: float = None):
+        await asyncio.sleep(self.delay if delay is None else delay)
+        await self._flush()
+        if self._dirty:
+            # 写入失败，或写入期间又有新的修改，稍后再次写入
+            retry = min(self.delay * 2 ** self.failures, MAX_RETRY_DELAY) if self.failures else None
+            self._task = asyncio.get_running_loop().create_task(self._delayed_flush(retry))
+
+    async def flush(self):
+        """立即写入尚未保存的修改（插件终止时调用）"""
+        task = self._task
+        if task is not None and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self._flush()
+
+    async def _flush(self):
+        async with self._lock:
+            if not self._dirty:
+                return
+            # 在事件循环中序列化，保证写入的是同一时刻的完整配置
+            content = self._serialize()
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._write, content)
+            except Exception as e:
+                self._dirty = True
+                self.failures += 1
+                logger.error(f"保存配置失败（第 {self.failures} 次）: {e}")
+            else:
+                self.failures = 0
+
+    def _serialize(self):
+        if self.path is None:
+            return None
+        return json.dumps(self.config, indent=2, ensure_ascii=False)
+
+    def _write(self, content):
+        """写入配置文件，content 为 None 时调用配置对象自身的保存方法"""
+        self.writes += 1
+        if content is None:
+            self.config.save_config()
+            return
+        path = self.path
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8-sig") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
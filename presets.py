@@ -0,0 +1,123 @@
+"""参数预设模块，为群组或用户保存独立的生成参数，叠加在全局配置之上"""
+
+import json
+import logging
+import os
+
+from .config_snapshot import ConfigSnapshot
+from .persistence import DebouncedWriter
+
+logger = logging.getLogger(__name__)
+
+# 可以按群组或用户覆盖的参数（base_model 为基础模型，其余为默认生成参数）
+PRESET_PARAMS = (
+    "width", "height", "steps", "sampler", "cfg_scale",
+    "batch_size", "n_iter", "seed", "upscaler", "upscale_factor", "base_model",
+)
+# 预设修改的合并写入等待时间（秒）
+PRESET_SAVE_DELAY = 5.0
+
+
+class PresetStore:
+    """参数预设存储
+
+    param_scope 为 group 或 user 时，参数设置命令只修改当前群组（私聊按用户）或当前用户的预设，
+    不再改写全局的 default_params。预设保存在内存中，每次修改都以新字典整体替换旧预设（写时复制），
+    读取方无需加锁；每个作用域缓存一份叠加了预设的配置快照，全局配置或预设变化后才重建，
+    获取快照是一次字典查找。预设的修改合并后写入 presets_path。
+    """
+
+    def __init__(self, config_manager, presets_path: str = None):
+        self.config_manager = config_manager
+        self._overlays = self._load(presets_path)
+        self._snapshots = {}  # scope_key -> ConfigSnapshot
+        self.writer = DebouncedWriter(self._overlays, PRESET_SAVE_DELAY, presets_path) if presets_path else None
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        """读取保存的预设，文件不存在或损坏时返回空预设"""
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8-sig") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取参数预设失败: {e}")
+            return {}
+        return {
+            key: {param: value for param, value in overlay.items() if param in PRESET_PARAMS}
+            for key, overlay in data.items() if isinstance(overlay, dict)
+        }
+
+    def scope_key(self, event):
+        """获取事件所属的预设作用域，全局作用域返回 None"""
+        scope = self.config_manager.get_param_scope()
+        if scope == "global":
+            return None
+        sender_id = str(event.get_sender_id())
+        if scope == "user":
+            return f"user:{sender_id}"
+        group_id = event.get_group_id()
+        return f"group:{group_id}" if group_id else f"private:{sender_id}"
+
+    def scope_label(self, event) -> str:
+        """作用域的展示文本，用于命令回复"""
+        scope = self.config_manager.get_param_scope()
+        if scope == "global":
+            return ""
+        if scope == "user":
+            return "（仅对你生效）"
+        return "（仅对本群生效）" if event.get_group_id() else "（仅对本会话生效）"
+
+    def overrides(self, event) -> dict:
+        """获取事件所属作用域的预设参数"""
+        key = self.scope_key(event)
+        return self._overlays.get(key, {}) if key is not None else {}
+
+    def snapshot(self, event) -> ConfigSnapshot:
+        """获取叠加了作用域预设的配置快照"""
+        base = self.config_manager.snapshot()
+        key = self.scope_key(event)
+        overlay = self._overlays.get(key) if key is not None else None
+        if not overlay:
+            return base
+
+        cached = self._snapshots.get(key)
+        if cached is not None and cached.version == base.version:
+            return cached
+        snapshot = ConfigSnapshot(self.config_manager, base.version, overlay)
+        self._snapshots[key] = snapshot
+        return snapshot
+
+    def set_params(self, event, params: dict):
+        """设置参数：全局作用域写入配置，其他作用域写入对应预设"""
+        key = self.scope_key(event)
+        if key is None:
+            for param, value in params.items():
+                if param == "base_model":
+                    self.config_manager.update_config("base_model", value)
+                else:
+                    self.config_manager.update_default_param(param, value)
+            return
+
+        self._overlays[key] = {**self._overlays.get(key, {}), **params}
+        self._snapshots.pop(key, None)
+        self._schedule_save()
+
+    def reset(self, event) -> bool:
+        """清除作用域的预设，恢复使用全局参数；没有预设时返回 False"""
+        key = self.scope_key(event)
+        if key is None or self._overlays.pop(key, None) is None:
+            return False
+        self._snapshots.pop(key, None)
+        self._schedule_save()
+        return True
+
+    def _schedule_save(self):
+        if self.writer is not None:
+            self.writer.schedule()
+
+    async def flush(self):
+        """立即保存尚未写入的预设"""
+        if self.writer is not None:
+            await self.writer.flush()
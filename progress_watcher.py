@@ -0,0 +1,87 @@
+"""进度监视模块，在生成过程中轮询WebUI的进度接口并向用户报告"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 进度轮询间隔的上下限（秒）
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 10.0
+
+
+class ProgressWatcher:
+    """生成进度监视器"""
+
+    def __init__(self, api_client, config_manager):
+        self.api_client = api_client
+        self.config_manager = config_manager
+
+    @staticmethod
+    def _next_interval(interval: float, progress: float, last_progress: float, eta: float) -> float:
+        """计算下一次轮询的间隔：进度有变化时按剩余时间调整，停滞时逐步放缓"""
+        if progress == last_progress:
+            return min(interval * 1.5, MAX_POLL_INTERVAL)
+        return min(max(eta / 4, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+    async def watch(self, event, task: asyncio.Future, call):
+        """在生成任务完成前轮询进度，并按限流间隔产出进度消息"""
+        message_interval = self.config_manager.get_progress_message_interval()
+        if message_interval <= 0:
+            return
+        include_preview = self.config_manager.get_progress_preview()
+
+        interval = MIN_POLL_INTERVAL
+        # 开始生成时已发送过阶段提示，第一条进度消息同样需要等待一个限流间隔
+        last_sent = time.monotonic()
+        last_progress = None
+        last_reported = 0.0
+        waiting_reported = False
+        pool = self.api_client.pool
+
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=interval)
+            if done:
+                return
+            if call.backend is None:
+                # 仍在等待可用的后端
+                continue
+            if not pool.is_running(call):
+                # 进度接口只反映后端正在执行的任务，本次调用仍在WebUI的队列中排队
+                interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+                now = time.monotonic()
+                if not waiting_reported and now - last_sent >= message_interval:
+                    waiting_reported = True
+                    last_sent = now
+                    yield event.plain_result("⏳ 已提交到WebUI，正在等待前面的任务完成")
+                continue
+
+            try:
+                data = await self.api_client.get_progress(call.backend, include_preview)
+            except ConnectionError as e:
+                logger.debug(f"查询生成进度失败: {e}")
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+                continue
+            if not pool.is_running(call):
+                # 查询期间本次调用已结束
+                continue
+
+            progress = data.get("progress") or 0.0
+            eta = data.get("eta_relative") or 0.0
+            interval = self._next_interval(interval, progress, last_progress, eta)
+            last_progress = progress
+
+            now = time.monotonic()
+            if progress <= last_reported or now - last_sent < message_interval:
+                continue
+            last_sent = now
+            last_reported = progress
+
+            text = f"⏳ 生成进度 {progress * 100:.0f}%，预计剩余 {eta:.0f} 秒"
+            preview = data.get("current_image") if include_preview else None
+            if preview:
+                from astrbot.api.all import Image, Plain
+                yield event.chain_result([Plain(text), Image.fromBase64(preview)])
+            else:
+                yield event.plain_result(text)
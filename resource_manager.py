@@ -1,12 +1,25 @@
 """资源管理模块，负责管理模型、采样器等资源"""
 
+import asyncio
 import logging
+import time
 
 from .api_client import SDWebUIClient
 from .config_manager import ConfigManager
 
 logger = logging.getLogger(__name__)
 
+# 各类资源列表的缓存有效期（秒）。采样器与上采样算法几乎不会变化，缓存更久
+RESOURCE_TTLS = {
+    "model": 300,
+    "lora": 300,
+    "embedding": 300,
+    "sampler": 3600,
+    "upscaler": 3600,
+}
+# 切换基础模型后需要失效的资源类型（已加载的LoRA/Embedding依赖于当前模型）
+MODEL_DEPENDENT_RESOURCES = ("lora", "embedding")
+
 
 class ResourceManager:
     """资源管理器"""
@@ -14,35 +27,70 @@ class ResourceManager:
     def __init__(self, api_client: SDWebUIClient, config_manager: ConfigManager):
         self.api_client = api_client
         self.config_manager = config_manager
+        # 资源目录缓存：resource_type -> (过期时间戳, 资源列表)
+        self._catalog = {}
+        # 进行中的刷新任务，同类型的并发请求共享一次拉取
+        self._refreshing = {}
+        # 缓存依赖模型的资源时后端加载的模型
+        self._catalog_model = api_client.current_model
+
+    async def _get_resources(self, resource_type: str) -> list:
+        """读取资源列表，缓存有效时直接返回；后端切换过模型时依赖模型的资源重新拉取"""
+        if self.api_client.current_model != self._catalog_model:
+            self._catalog_model = self.api_client.current_model
+            self.invalidate(*MODEL_DEPENDENT_RESOURCES)
+        cached = self._catalog.get(resource_type)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return await self._refresh(resource_type)
+
+    async def _refresh(self, resource_type: str) -> list:
+        """从WebUI重新拉取资源列表并写入缓存"""
+        task = self._refreshing.get(resource_type)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(resource_type))
+            self._refreshing[resource_type] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(resource_type, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, resource_type: str) -> list:
+        resources = await self.api_client.fetch_resources(resource_type)
+        # 空列表通常意味着请求失败，不缓存以便下次重试
+        if resources:
+            self._catalog[resource_type] = (time.monotonic() + RESOURCE_TTLS[resource_type], resources)
+        return resources
+
+    def invalidate(self, *resource_types: str):
+        """使指定类型（未指定时为全部类型）的资源缓存失效"""
+        for resource_type in resource_types or RESOURCE_TTLS:
+            self._catalog.pop(resource_type, None)
+
+    async def refresh_all(self) -> dict:
+        """强制并发刷新全部资源列表，返回各类型的资源数量"""
+        self.invalidate()
+        resource_types = list(RESOURCE_TTLS)
+        results = await asyncio.gather(*(self._refresh(t) for t in resource_types))
+        return {t: len(resources) for t, resources in zip(resource_types, results)}
 
     async def get_model_list(self):
         """获取可用的模型列表"""
-        return await self.api_client.fetch_resources("model")
+        return await self._get_resources("model")
 
     async def get_lora_list(self):
         """获取可用的LoRA模型列表"""
-        return await self.api_client.fetch_resources("lora")
+        return await self._get_resources("lora")
 
     async def get_embedding_list(self):
         """获取已加载的Embedding模型列表"""
-        return await self.api_client.fetch_resources("embedding")
+        return await self._get_resources("embedding")
 
     async def get_sampler_list(self):
         """获取可用的采样器列表"""
-        return await self.api_client.fetch_resources("sampler")
+        return await self._get_resources("sampler")
 
     async def get_upscaler_list(self):
         """获取可用的上采样算法列表"""
-        return await self.api_client.fetch_resources("upscaler")
-
-    async def set_model(self, model_name: str) -> bool:
-        """设置当前使用的模型"""
-        success = await self.api_client.set_model(model_name)
-        if success:
-            # 更新配置中的模型
-            self.config_manager.config["base_model"] = model_name
-            self.config_manager.config.save_config()
-        return success
+        return await self._get_resources("upscaler")
 
     def format_resource_list(self, resources: list, resource_name: str) -> str:
         """格式化资源列表为用户友好的字符串"""
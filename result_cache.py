@@ -0,0 +1,134 @@
+"""结果缓存模块，以内容寻址的方式在磁盘上缓存确定性生成的图像"""
+
+import asyncio
+import logging
+import os
+import shutil
+from collections import OrderedDict
+
+from .image_record import ImageRecord
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """生成结果的磁盘缓存
+
+    每个缓存项是 cache_dir 下以请求摘要命名的目录，按序号保存解码后的图像文件。
+    总大小超过 max_bytes 时按最近最少使用的顺序淘汰，访问顺序通过目录修改时间
+    在重启后恢复。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> 缓存项字节数
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用缓存"""
+        return self.max_bytes > 0
+
+    def _load_index(self):
+        """扫描缓存目录，按修改时间重建LRU索引"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, key)
+            if key.endswith(".tmp"):
+                # 清理上次中断时残留的半成品
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            if not os.path.isdir(entry_dir):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, name))
+                for name in os.listdir(entry_dir)
+            )
+            entries.append((os.path.getmtime(entry_dir), key, size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    async def _ensure_loaded(self):
+        if not self._loaded:
+            await asyncio.to_thread(self._load_index)
+            self._loaded = True
+
+    def _read_entry(self, key: str) -> list:
+        entry_dir = os.path.join(self.cache_dir, key)
+        images = []
+        for name in sorted(os.listdir(entry_dir), key=lambda n: int(n.split(".")[0])):
+            with open(os.path.join(entry_dir, name), "rb") as f:
+                images.append(ImageRecord(data=f.read(), index=len(images)))
+        # 更新修改时间，使重启后的LRU顺序与访问顺序一致
+        os.utime(entry_dir)
+        return images
+
+    def _write_entry(self, key: str, images: list) -> int:
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = f"{entry_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        size = 0
+        for i, record in enumerate(images):
+            target = os.path.join(tmp_dir, f"{i}.png")
+            if record.path is not None:
+                # 已写入暂存区的图像直接复制文件，不读入内存
+                shutil.copyfile(record.path, target)
+            else:
+                with open(target, "wb") as f:
+                    f.write(record.view())
+            size += os.path.getsize(target)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.rename(tmp_dir, entry_dir)
+        return size
+
+    def _remove_entries(self, keys: list):
+        for key in keys:
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    async def get(self, key: str):
+        """读取缓存的图像记录列表，未命中时返回 None"""
+        if not self.enabled:
+            return None
+        async with self._lock:
+            await self._ensure_loaded()
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            return await asyncio.to_thread(self._read_entry, key)
+        except OSError as e:
+            logger.warning(f"读取结果缓存失败: {e}")
+            async with self._lock:
+                self._total_bytes -= self._entries.pop(key, 0)
+            return None
+
+    async def put(self, key: str, images: list):
+        """写入生成结果，并按字节预算淘汰最久未使用的缓存项"""
+        if not self.enabled or not images:
+            return
+        async with self._lock:
+            await self._ensure_loaded()
+            try:
+                size = await asyncio.to_thread(self._write_entry, key, images)
+            except OSError as e:
+                logger.warning(f"写入结果缓存失败: {e}")
+                return
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total_bytes += size
+
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_key)
+            if evicted:
+                await asyncio.to_thread(self._remove_entries, evicted)
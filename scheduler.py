@@ -0,0 +1,167 @@
+"""任务调度模块，按群组与用户公平地分配生成任务的并发槽位"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+
+class Ticket:
+    """排队凭证，表示一个等待或占用槽位的任务"""
+
+    def __init__(self, group_key: str, sender_key: str, model: str = ""):
+        self.group_key = group_key
+        self.sender_key = sender_key
+        self.model = model
+        # 被同模型任务插队的次数，用于限制亲和调度带来的不公平
+        self.skips = 0
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.released = False
+
+
+class FairScheduler:
+    """公平调度器
+
+    每个群组维护一个按用户划分的队列集合。出队时先在群组之间轮转，
+    再在同一群组的用户之间轮转，避免单个群组或用户占满所有槽位。
+
+    在轮转顺序之上，调度器会优先分配与当前模型相同的任务，并且在有任务运行时
+    不会分配需要其他模型的任务，使同一模型的任务成批执行，减少模型切换。
+    被插队次数达到 max_affinity_skips 的任务会在当前批次结束后优先执行。
+    """
+
+    def __init__(self, capacity: int, max_affinity_skips: int = 5, current_model: str = ""):
+        self.capacity = max(1, capacity)
+        self.max_affinity_skips = max(0, max_affinity_skips)
+        self.running = 0
+        # 当前批次（正在运行或最近运行）的任务所使用的模型
+        self.current_model = current_model
+        self.model_switches = 0
+        # group_key -> OrderedDict(sender_key -> deque[Ticket])
+        self._groups = OrderedDict()
+        self._queued = 0
+
+    @property
+    def queued(self) -> int:
+        """排队中的任务数"""
+        return self._queued
+
+    def set_capacity(self, capacity: int):
+        """调整并发槽位数"""
+        self.capacity = max(1, capacity)
+        self._dispatch()
+
+    def submit(self, group_key: str, sender_key: str, model: str = "") -> Ticket:
+        """提交任务并返回凭证，有空闲槽位时立即分配；model 为空表示不限模型"""
+        ticket = Ticket(group_key, sender_key, model)
+        senders = self._groups.setdefault(group_key, OrderedDict())
+        senders.setdefault(sender_key, deque()).append(ticket)
+        self._queued += 1
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: Ticket):
+        """等待凭证获得槽位"""
+        await ticket.future
+
+    def release(self, ticket: Ticket):
+        """释放凭证：已获得槽位的归还槽位，仍在排队的移出队列"""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            self.running -= 1
+        else:
+            self._remove(ticket)
+            if not ticket.future.done():
+                ticket.future.cancel()
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """计算凭证的排队位置，0 表示已获得槽位"""
+        if ticket.granted or ticket.released:
+            return 0
+        order = 0
+        for queued in self._iter_order():
+            order += 1
+            if queued is ticket:
+                return order
+        return 0
+
+    def _iter_order(self):
+        """按调度顺序遍历排队中的凭证（不修改队列）"""
+        groups = deque(
+            deque(deque(tickets) for tickets in senders.values())
+            for senders in self._groups.values()
+        )
+        while groups:
+            senders = groups.popleft()
+            tickets = senders.popleft()
+            yield tickets.popleft()
+            if tickets:
+                senders.append(tickets)
+            if senders:
+                groups.append(senders)
+
+    def _remove(self, ticket: Ticket):
+        """将凭证从队列中移除"""
+        senders = self._groups.get(ticket.group_key)
+        if not senders:
+            return
+        tickets = senders.get(ticket.sender_key)
+        if not tickets:
+            return
+        try:
+            tickets.remove(ticket)
+        except ValueError:
+            return
+        self._queued -= 1
+        if not tickets:
+            del senders[ticket.sender_key]
+        if not senders:
+            del self._groups[ticket.group_key]
+
+    def _take(self, ticket: Ticket):
+        """取出凭证，并将其群组与用户移到轮转顺序的末尾"""
+        senders = self._groups[ticket.group_key]
+        self._remove(ticket)
+        if ticket.sender_key in senders:
+            senders.move_to_end(ticket.sender_key)
+        if ticket.group_key in self._groups:
+            self._groups.move_to_end(ticket.group_key)
+
+    def _matches_current(self, ticket: Ticket) -> bool:
+        """任务能否在当前模型上执行"""
+        return not ticket.model or ticket.model == self.current_model
+
+    def _select(self):
+        """选择下一个要分配槽位的凭证，没有可分配的凭证时返回 None"""
+        order = list(self._iter_order())
+        for position, ticket in enumerate(order):
+            if self._matches_current(ticket):
+                for skipped in order[:position]:
+                    skipped.skips += 1
+                return ticket
+            if ticket.skips >= self.max_affinity_skips:
+                # 等待过久的任务：不再让同模型任务插队，待当前批次结束后切换模型执行
+                return ticket if self.running == 0 else None
+
+        # 队列中没有同模型的任务，当前批次结束后按轮转顺序切换
+        return order[0] if self.running == 0 else None
+
+    def _dispatch(self):
+        """在有空闲槽位时依次分配给排队中的凭证"""
+        while self.running < self.capacity and self._groups:
+            ticket = self._select()
+            if ticket is None:
+                break
+            self._take(ticket)
+            if ticket.future.done():
+                continue
+            if ticket.model and ticket.model != self.current_model:
+                self.current_model = ticket.model
+                self.model_switches += 1
+            ticket.granted = True
+            self.running += 1
+            ticket.future.set_result(None)
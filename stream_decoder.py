@@ -0,0 +1,109 @@
+"""流式解码模块，从分块到达的JSON响应中逐个提取图像数据"""
+
+QUOTE = ord('"')
+BACKSLASH = ord("\\")
+OPENERS = (ord("{"), ord("["))
+CLOSERS = (ord("}"), ord("]"))
+COLON = ord(":")
+COMMA = ord(",")
+# 顶层键名的最大记录长度，更长的字符串不可能是目标键
+MAX_KEY_LENGTH = 64
+
+
+class ImagesStreamParser:
+    """增量解析 txt2img 响应中顶层 images 数组的解析器
+
+    WebUI 的响应形如 {"images": ["<base64>", ...], "parameters": {...}, "info": "..."}。
+    解析器只保留当前正在读取的一张图像，每当一个数组元素读取完成就将其返回，
+    其余字段只做结构跟踪而不缓存，因此内存占用与单张图像相当，而不是整个响应。
+    """
+
+    def __init__(self, key: str = "images"):
+        self.key = key.encode("utf-8")
+        self.images_seen = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer = None
+        self._capture_image = False
+        self._last_key = None
+        self._expect_array = False
+        self._in_images = False
+
+    def feed(self, chunk: bytes) -> list:
+        """输入一段响应数据，返回本段中读取完成的图像（base64 的 bytearray 列表）"""
+        completed = []
+        i, n = 0, len(chunk)
+        while i < n:
+            if self._in_string:
+                i = self._consume_string(chunk, i, n, completed)
+                continue
+
+            c = chunk[i]
+            if c == QUOTE:
+                self._start_string()
+            elif c in OPENERS:
+                self._depth += 1
+                if self._expect_array and self._depth == 2 and c == OPENERS[1]:
+                    self._in_images = True
+                self._expect_array = False
+            elif c in CLOSERS:
+                if self._in_images and self._depth == 2:
+                    self._in_images = False
+                self._depth -= 1
+            elif self._depth == 1:
+                if c == COLON:
+                    self._expect_array = self._last_key == self.key
+                elif c == COMMA:
+                    self._last_key = None
+                    self._expect_array = False
+            i += 1
+        return completed
+
+    def _start_string(self):
+        """进入字符串，根据所处位置决定是否需要保留其内容"""
+        self._in_string = True
+        self._capture_image = self._in_images and self._depth == 2
+        # 顶层字符串可能是键名，仅保留较短的内容用于比较
+        self._buffer = bytearray() if self._capture_image or self._depth == 1 else None
+
+    def _consume_string(self, chunk: bytes, i: int, n: int, completed: list) -> int:
+        """读取字符串内容直到结束引号或本段末尾，返回新的读取位置"""
+        buffer = self._buffer
+        if self._escape:
+            self._escape = False
+            if buffer is not None:
+                # 图像与键名中只可能出现 \/ 这类转义，直接保留被转义的字符
+                buffer.append(chunk[i])
+            return i + 1
+
+        quote = chunk.find(b'"', i)
+        backslash = chunk.find(b"\\", i, quote if quote != -1 else n)
+        end = backslash if backslash != -1 else quote
+        if end == -1:
+            self._append(chunk[i:n])
+            return n
+
+        self._append(chunk[i:end])
+        if end == backslash:
+            self._escape = True
+            return end + 1
+
+        buffer = self._buffer
+        self._in_string = False
+        if self._capture_image:
+            completed.append(buffer)
+            self.images_seen += 1
+        elif buffer is not None:
+            self._last_key = bytes(buffer)
+        self._buffer = None
+        self._capture_image = False
+        return end + 1
+
+    def _append(self, data: bytes):
+        """追加字符串内容，顶层字符串过长时放弃记录"""
+        if self._buffer is None:
+            return
+        self._buffer += data
+        if not self._capture_image and len(self._buffer) > MAX_KEY_LENGTH:
+            self._buffer = None
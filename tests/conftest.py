@@ -0,0 +1,16 @@
+"""测试配置
+
+插件目录以相对导入组织模块，且 __init__.py 会导入依赖 AstrBot 的模块。
+这里将插件目录注册为 sdgen 包（不执行 __init__.py），测试直接导入各个纯逻辑模块。
+"""
+
+import os
+import sys
+import types
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "sdgen" not in sys.modules:
+    package = types.ModuleType("sdgen")
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules["sdgen"] = package
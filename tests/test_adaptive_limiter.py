@@ -0,0 +1,161 @@
+import asyncio
+
+from sdgen import adaptive_limiter
+from sdgen.adaptive_limiter import ADJUST_INTERVAL, AdaptiveLimiter
+from sdgen.metrics import Metrics
+from sdgen.scheduler import FairScheduler
+
+PAYLOAD = {"width": 512, "height": 512, "steps": 20, "batch_size": 1, "n_iter": 1}
+
+
+class FakeBackend:
+    url = "http://gpu"
+    healthy = True
+
+
+class FakePool:
+    backends = [FakeBackend()]
+
+
+class FakeApiClient:
+    def __init__(self):
+        self.metrics = Metrics()
+        self.pool = FakePool()
+        self.memory = {}
+
+    async def get_memory(self, backend):
+        return self.memory
+
+
+class FakeConfigManager:
+    def get_min_concurrent_tasks(self):
+        return 1
+
+    def get_max_concurrent_tasks(self):
+        return 8
+
+    def get_vram_high_watermark(self):
+        return 0.9
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float = ADJUST_INTERVAL):
+        self.now += seconds
+
+
+def make_limiter(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(adaptive_limiter.time, "monotonic", clock)
+    api_client = FakeApiClient()
+    scheduler = FairScheduler(1)
+    limiter = AdaptiveLimiter(api_client, FakeConfigManager(), scheduler)
+    return limiter, scheduler, api_client, clock
+
+
+def saturate(scheduler: FairScheduler):
+    """占满全部槽位并留一个排队的任务"""
+    while scheduler.queued == 0:
+        scheduler.submit("g", f"u{scheduler.running}")
+
+
+def test_slow_start_doubles_then_oom_halves_and_growth_becomes_additive(monkeypatch):
+    async def scenario():
+        limiter, scheduler, _, clock = make_limiter(monkeypatch)
+        limits = [limiter.limit]
+        for _ in range(3):
+            saturate(scheduler)
+            limiter.record(PAYLOAD, 1.0)
+            await limiter.adjust()
+            limits.append(limiter.limit)
+
+        limiter.record(PAYLOAD, 1.0, RuntimeError("CUDA out of memory"))
+        limits.append(limiter.limit)
+
+        clock.advance()
+        saturate(scheduler)
+        limiter.record(PAYLOAD, 1.0)
+        await limiter.adjust()
+        limits.append(limiter.limit)
+        return limits, limiter, scheduler
+
+    limits, limiter, scheduler = asyncio.run(scenario())
+    # 慢启动成倍增加到上限 8，显存不足减半，之后每周期加一
+    assert limits == [1, 2, 4, 8, 4, 5]
+    assert not limiter.slow_start
+    assert scheduler.capacity == 5
+
+
+def test_no_increase_without_queue_pressure(monkeypatch):
+    async def scenario():
+        limiter, _, _, _ = make_limiter(monkeypatch)
+        limiter.record(PAYLOAD, 1.0)
+        await limiter.adjust()
+        return limiter.limit
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_latency_above_baseline_backs_off_once_per_interval(monkeypatch):
+    async def scenario():
+        limiter, _, _, clock = make_limiter(monkeypatch)
+        limiter.set_bounds(1, 8)
+        limiter._set_limit(8, "test")
+        limiter.record(PAYLOAD, 1.0)
+        await limiter.adjust()
+
+        limiter.record(PAYLOAD, 3.0)
+        await limiter.adjust()
+        first = limiter.limit
+
+        # 减小后的一个周期内不再减小，以观察调整的效果
+        limiter.record(PAYLOAD, 5.0)
+        await limiter.adjust()
+        second = limiter.limit
+
+        clock.advance()
+        limiter.record(PAYLOAD, 5.0)
+        await limiter.adjust()
+        return first, second, limiter.limit, limiter.last_reason
+
+    first, second, third, reason = asyncio.run(scenario())
+    assert (first, second, third) == (6, 6, 4)
+    assert "基线" in reason
+
+
+def test_vram_watermark_and_error_rate_decrease(monkeypatch):
+    async def scenario():
+        limiter, _, api_client, clock = make_limiter(monkeypatch)
+        limiter._set_limit(8, "test")
+        api_client.memory = {"cuda": {"system": {"total": 100, "used": 99}, "active": {"current": 95}}}
+        await limiter.adjust()
+        after_vram = limiter.limit
+
+        clock.advance()
+        api_client.memory = {"cuda": {"system": {"total": 100, "used": 99}, "active": {"current": 40}}}
+        for _ in range(3):
+            limiter.record(PAYLOAD, 1.0, ConnectionError("API错误 (500)"))
+        await limiter.adjust()
+        return after_vram, limiter.limit
+
+    assert asyncio.run(scenario()) == (6, 4)
+
+
+def test_new_oom_events_reported_by_backend_halve_limit(monkeypatch):
+    async def scenario():
+        limiter, _, api_client, _ = make_limiter(monkeypatch)
+        limiter._set_limit(8, "test")
+        api_client.memory = {"cuda": {"events": {"oom": 2}}}
+        await limiter.adjust()
+        unchanged = limiter.limit
+
+        api_client.memory = {"cuda": {"events": {"oom": 3}}}
+        await limiter.adjust()
+        return unchanged, limiter.limit
+
+    assert asyncio.run(scenario()) == (8, 4)
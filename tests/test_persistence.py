@@ -0,0 +1,37 @@
+import asyncio
+
+from sdgen import persistence
+from sdgen.persistence import DebouncedWriter
+
+
+class FlakyConfig(dict):
+    """前几次保存失败的配置对象"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.saved = 0
+
+    def save_config(self):
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.saved += 1
+
+
+def test_failed_write_is_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(persistence, "MAX_RETRY_DELAY", 0.04)
+
+    async def scenario():
+        config = FlakyConfig(failures=2)
+        writer = DebouncedWriter(config, delay=0.01)
+        writer.schedule()
+        await asyncio.sleep(0.02)
+        assert writer.pending and writer.failures == 1
+
+        await asyncio.sleep(0.2)
+        return config, writer
+
+    config, writer = asyncio.run(scenario())
+    assert config.saved == 1
+    assert not writer.pending and writer.failures == 0 and writer.writes == 3
@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from sdgen import cache_utils
+from sdgen.cache_utils import TTLCache
+from sdgen.llm_tools import LLMTools
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeConfigManager:
+    def get_prompt_cache_size(self):
+        return 8
+
+    def get_prompt_cache_ttl(self):
+        return 60
+
+
+def test_ttl_cache_entries_expire(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_utils.time, "time", clock)
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2, expires_at=clock.now + 30)
+
+    clock.now += 9
+    assert cache.get("a") == 1
+
+    clock.now += 1
+    assert cache.get("a") is None and "a" not in cache
+    assert [key for key, _, _ in cache.items()] == ["b"]
+
+    clock.now += 20
+    assert cache.get("b", "missing") == "missing"
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "b" not in cache and cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_disk_cache_skips_undecodable_lines(tmp_path):
+    path = tmp_path / "prompt_cache.jsonl"
+    good = json.dumps({"key": "k1", "expires_at": 4102444800, "prompt": "1girl, 风景"}, ensure_ascii=False)
+    path.write_bytes(good.encode("utf-8") + b"\n" + b'{"key": "k2", "prompt": "\xff\xfe"}\n' + b"[1, 2]\n")
+
+    tools = LLMTools(None, FakeConfigManager(), str(path))
+    asyncio.run(tools._ensure_disk_loaded())
+
+    assert tools._disk_loaded
+    assert tools.prompt_cache.get("k1") == "1girl, 风景"
+    assert tools.prompt_cache.get("k2") is None
+    # 加载后按内存缓存压缩文件，损坏的行被丢弃
+    assert path.read_text(encoding="utf-8").count("\n") == 1
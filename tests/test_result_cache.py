@@ -0,0 +1,76 @@
+import asyncio
+import os
+
+from sdgen.image_record import ImageRecord
+from sdgen.result_cache import ResultCache
+
+
+def images(size: int, count: int = 1) -> list:
+    return [ImageRecord(data=bytes([i]) * size, index=i) for i in range(count)]
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    async def scenario():
+        cache = ResultCache(str(tmp_path), max_bytes=250)
+        await cache.put("a", images(100))
+        await cache.put("b", images(100))
+        # 读取 a 使其成为最近使用的缓存项
+        assert await cache.get("a") is not None
+        await cache.put("c", images(100))
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert list(cache._entries) == ["a", "c"] and cache._total_bytes == 200
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+
+
+def test_hit_returns_images_in_order(tmp_path):
+    async def scenario():
+        cache = ResultCache(str(tmp_path), max_bytes=1024)
+        await cache.put("k", images(10, count=3))
+        return await cache.get("k"), await cache.get("missing")
+
+    hit, miss = asyncio.run(scenario())
+    assert miss is None
+    assert [record.index for record in hit] == [0, 1, 2]
+    assert [record.data for record in hit] == [bytes([i]) * 10 for i in range(3)]
+
+
+def test_oversized_entry_is_kept_alone(tmp_path):
+    async def scenario():
+        cache = ResultCache(str(tmp_path), max_bytes=100)
+        await cache.put("a", images(50))
+        await cache.put("b", images(300))
+        return cache
+
+    cache = asyncio.run(scenario())
+    # 超出预算的单个缓存项仍会保留，只淘汰更旧的缓存项
+    assert list(cache._entries) == ["b"]
+
+
+def test_index_is_rebuilt_from_disk_in_access_order(tmp_path):
+    async def scenario():
+        cache = ResultCache(str(tmp_path), max_bytes=1024)
+        await cache.put("old", images(10))
+        await cache.put("new", images(10))
+        old_dir = os.path.join(str(tmp_path), "old")
+        os.utime(old_dir, (1, 1))
+        os.makedirs(os.path.join(str(tmp_path), "partial.tmp"))
+
+        restarted = ResultCache(str(tmp_path), max_bytes=1024)
+        await restarted._ensure_loaded()
+        return restarted
+
+    restarted = asyncio.run(scenario())
+    assert list(restarted._entries) == ["old", "new"]
+    assert not os.path.exists(os.path.join(str(tmp_path), "partial.tmp"))
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    async def scenario():
+        cache = ResultCache(str(tmp_path / "cache"), max_bytes=0)
+        await cache.put("a", images(10))
+        return await cache.get("a")
+
+    assert asyncio.run(scenario()) is None
+    assert not (tmp_path / "cache").exists()
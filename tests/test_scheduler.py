@@ -0,0 +1,122 @@
+import asyncio
+
+from sdgen.scheduler import FairScheduler
+
+
+def grant_order(scheduler: FairScheduler, tickets: list) -> list:
+    """依次归还已获得槽位的凭证，返回凭证获得槽位的顺序"""
+    order = []
+    pending = list(tickets)
+    while pending:
+        granted = [ticket for ticket in pending if ticket.granted]
+        assert granted, "有排队任务但没有分配槽位"
+        for ticket in granted:
+            order.append(ticket)
+            pending.remove(ticket)
+            scheduler.release(ticket)
+    return order
+
+
+def test_round_robin_across_groups_then_users():
+    async def scenario():
+        scheduler = FairScheduler(1)
+        first = scheduler.submit("g1", "u1")
+        queued = [
+            scheduler.submit("g1", "u1"),
+            scheduler.submit("g1", "u1"),
+            scheduler.submit("g1", "u2"),
+            scheduler.submit("g2", "u3"),
+            scheduler.submit("g2", "u3"),
+        ]
+        assert first.granted and not any(ticket.granted for ticket in queued)
+        order = grant_order(scheduler, [first] + queued)
+        return [(ticket.group_key, ticket.sender_key) for ticket in order]
+
+    # 群组之间轮转（g1, g2, g1, g2, g1），群组内的用户之间轮转（u1, u2, u1）
+    assert asyncio.run(scenario()) == [
+        ("g1", "u1"),
+        ("g1", "u1"),
+        ("g2", "u3"),
+        ("g1", "u2"),
+        ("g2", "u3"),
+        ("g1", "u1"),
+    ]
+
+
+def test_capacity_limits_running_and_position_tracks_queue():
+    async def scenario():
+        scheduler = FairScheduler(2)
+        tickets = [scheduler.submit("g", f"u{i}") for i in range(4)]
+        assert scheduler.running == 2 and scheduler.queued == 2
+        assert [scheduler.position(ticket) for ticket in tickets] == [0, 0, 1, 2]
+
+        scheduler.release(tickets[0])
+        assert tickets[2].granted and scheduler.position(tickets[3]) == 1
+
+        scheduler.set_capacity(4)
+        assert tickets[3].granted and scheduler.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_releasing_queued_ticket_cancels_it():
+    async def scenario():
+        scheduler = FairScheduler(1)
+        running = scheduler.submit("g", "u1")
+        queued = scheduler.submit("g", "u2")
+        scheduler.release(queued)
+        assert queued.future.cancelled() and scheduler.queued == 0
+
+        scheduler.release(running)
+        assert scheduler.running == 0
+
+    asyncio.run(scenario())
+
+
+def test_queued_jobs_are_grouped_by_checkpoint():
+    async def scenario():
+        scheduler = FairScheduler(2, max_affinity_skips=5, current_model="A")
+        first = scheduler.submit("g1", "u1", "A")
+        queued = [
+            scheduler.submit("g2", "u2", "B"),
+            scheduler.submit("g3", "u3", "A"),
+            scheduler.submit("g4", "u4", "B"),
+            scheduler.submit("g5", "u5", "A"),
+        ]
+        # 需要 B 的任务在 A 的任务运行期间不会获得槽位，同模型的任务可以插队
+        assert queued[1].granted and not queued[0].granted
+        order = grant_order(scheduler, [first] + queued)
+        return [ticket.model for ticket in order], scheduler.model_switches
+
+    models, switches = asyncio.run(scenario())
+    assert models == ["A", "A", "A", "B", "B"]
+    assert switches == 1
+
+
+def test_other_checkpoint_waits_for_running_slots_to_drain():
+    async def scenario():
+        scheduler = FairScheduler(2, current_model="A")
+        running = scheduler.submit("g1", "u1", "A")
+        other = scheduler.submit("g2", "u2", "B")
+        # 有空闲槽位，但 A 的任务仍在运行，切换模型会影响它
+        assert not other.granted and scheduler.current_model == "A"
+
+        scheduler.release(running)
+        assert other.granted and scheduler.current_model == "B"
+
+    asyncio.run(scenario())
+
+
+def test_affinity_skips_are_bounded():
+    async def scenario():
+        scheduler = FairScheduler(1, max_affinity_skips=2, current_model="A")
+        first = scheduler.submit("g1", "u1", "A")
+        waiting = scheduler.submit("g2", "u2", "B")
+        same = [scheduler.submit("g3", "u3", "A") for _ in range(4)]
+        order = grant_order(scheduler, [first, waiting] + same)
+        return [ticket.model for ticket in order], waiting.skips
+
+    models, skips = asyncio.run(scenario())
+    # 被插队两次后，B 的任务在当前任务结束后优先执行
+    assert models == ["A", "A", "A", "B", "A", "A"]
+    assert skips == 2
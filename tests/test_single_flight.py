@@ -0,0 +1,138 @@
+import asyncio
+import base64
+import json
+import os
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from sdgen.api_client import SDWebUIClient  # noqa: E402
+from sdgen.config_manager import ConfigManager  # noqa: E402
+from sdgen.image_processor import ImageProcessor  # noqa: E402
+from sdgen.image_record import ImageRecord  # noqa: E402
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PluginConfig(dict):
+    """以 _conf_schema.json 的默认值构建的插件配置"""
+
+    def __init__(self, **overrides):
+        with open(os.path.join(PLUGIN_DIR, "_conf_schema.json"), encoding="utf-8") as f:
+            schema = json.load(f)
+        values = {
+            key: {name: sub.get("default") for name, sub in item["items"].items()}
+            if item.get("type") == "object" else item.get("default")
+            for key, item in schema.items()
+        }
+        values.update(overrides)
+        super().__init__(values)
+
+    def save_config(self, replace_config: dict = None):
+        pass
+
+
+class FakeEvent:
+    def __init__(self, sender_id: str, group_id: str = ""):
+        self.sender_id = sender_id
+        self.group_id = group_id
+
+    def get_sender_id(self):
+        return self.sender_id
+
+    def get_group_id(self):
+        return self.group_id
+
+    def get_platform_name(self):
+        return "test"
+
+    def plain_result(self, text: str):
+        return ("text", text)
+
+    def chain_result(self, chain: list):
+        return ("chain", chain)
+
+
+def make_processor(monkeypatch):
+    config_manager = ConfigManager(PluginConfig(
+        webui_url="http://127.0.0.1:7860", verbose=False, enable_generate_prompt=False, positive_prompt_global=""
+    ))
+    api_client = SDWebUIClient(config_manager)
+    processor = ImageProcessor(api_client, config_manager)
+    # 测试环境没有 AstrBot，直接返回图像记录
+    monkeypatch.setattr(ImageProcessor, "_to_component", staticmethod(lambda record: record))
+
+    release = asyncio.Event()
+    calls = []
+
+    async def stream_text_to_image(payload, call=None):
+        calls.append(payload["prompt"])
+        await release.wait()
+        yield ImageRecord(base64_data=base64.b64encode(payload["prompt"].encode()).decode(), index=0)
+
+    monkeypatch.setattr(api_client, "stream_text_to_image", stream_text_to_image)
+    return processor, release, calls
+
+
+async def collect(processor, event, prompt: str) -> list:
+    return [result async for result in processor.generate_image_with_scheduler(event, prompt)]
+
+
+def images_of(results: list) -> list:
+    return [record.data for kind, chain in results if kind == "chain" for record in chain]
+
+
+def test_identical_requests_share_one_generation(monkeypatch):
+    async def scenario():
+        processor, release, calls = make_processor(monkeypatch)
+        requests = [
+            asyncio.ensure_future(collect(processor, FakeEvent(f"u{i}", "g"), "same prompt"))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0.05)
+        # 后两个请求合并到第一个请求的生成任务上，不占用调度槽位
+        assert len(processor._inflight) == 1 and processor.scheduler.running == 1
+        release.set()
+        results = await asyncio.gather(*requests)
+        return processor, calls, results
+
+    processor, calls, results = asyncio.run(scenario())
+    assert calls == ["same prompt"]
+    assert [images_of(result) for result in results] == [[b"same prompt"]] * 3
+    assert processor._inflight == {} and processor.scheduler.running == 0
+
+
+def test_different_requests_are_not_coalesced(monkeypatch):
+    async def scenario():
+        processor, release, calls = make_processor(monkeypatch)
+        first = asyncio.ensure_future(collect(processor, FakeEvent("u1"), "cat"))
+        second = asyncio.ensure_future(collect(processor, FakeEvent("u2"), "dog"))
+        await asyncio.sleep(0.05)
+        release.set()
+        return calls, await first, await second
+
+    calls, first, second = asyncio.run(scenario())
+    assert sorted(calls) == ["cat", "dog"]
+    assert images_of(first) == [b"cat"] and images_of(second) == [b"dog"]
+
+
+def test_cancelling_one_waiter_keeps_the_shared_generation(monkeypatch):
+    async def scenario():
+        processor, release, calls = make_processor(monkeypatch)
+        leaving = asyncio.ensure_future(collect(processor, FakeEvent("u1"), "same prompt"))
+        staying = asyncio.ensure_future(collect(processor, FakeEvent("u2"), "same prompt"))
+        await asyncio.sleep(0.05)
+        job = processor.jobs.active_jobs("u1")[0]
+        processor.cancel_job(job)
+        await asyncio.sleep(0.01)
+        shared = next(iter(processor._inflight.values()))
+        assert not shared.task.done()
+
+        release.set()
+        return calls, await leaving, await staying
+
+    calls, leaving, staying = asyncio.run(scenario())
+    assert calls == ["same prompt"]
+    assert ("text", "🛑 任务 1 已取消") in leaving
+    assert images_of(staying) == [b"same prompt"]
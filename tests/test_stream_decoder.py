@@ -0,0 +1,36 @@
+from sdgen.stream_decoder import ImagesStreamParser
+
+# WebUI 会把 base64 中的 / 转义为 \/，其他字段中可能出现名为 images 的键与转义引号
+RESPONSE = (
+    b'{"parameters": {"images": ["not-an-image"], "prompt": "a \\"quoted\\" \\\\ prompt"}, '
+    b'"images": ["aGVsbG8=", "d29y\\/bGQ=", ""], '
+    b'"info": "{\\"images\\": [\\"nested\\"]}"}'
+)
+
+
+def feed_in_chunks(data: bytes, size: int) -> list:
+    parser = ImagesStreamParser()
+    images = []
+    for start in range(0, len(data), size):
+        images += [bytes(image) for image in parser.feed(data[start:start + size])]
+    return images
+
+
+def test_only_top_level_images_are_extracted():
+    assert feed_in_chunks(RESPONSE, len(RESPONSE)) == [b"aGVsbG8=", b"d29y/bGQ=", b""]
+
+
+def test_every_chunk_boundary_gives_the_same_result():
+    # 分块可能在转义符与被转义字符之间、键名或引号中间断开
+    expected = [b"aGVsbG8=", b"d29y/bGQ=", b""]
+    for size in range(1, 24):
+        assert feed_in_chunks(RESPONSE, size) == expected, size
+
+
+def test_split_key_and_escaped_quote_in_other_strings():
+    data = b'{"info": "say \\"images\\": [\\"x\\"]", "ima' + b'ges": ["QUJD"]}'
+    parser = ImagesStreamParser()
+    first = parser.feed(data[:30])
+    second = parser.feed(data[30:])
+    assert first == [] and [bytes(image) for image in second] == [b"QUJD"]
+    assert parser.images_seen == 1
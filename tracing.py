@@ -0,0 +1,220 @@
+"""链路追踪模块，通过 contextvars 在命令、图像处理与API调用之间传递追踪上下文
+
+追踪上下文只在执行请求的独立任务中设置（见 use_trace），不会在异步生成器的 yield 之间
+停留在调用方的上下文中：被放弃的生成器在其他上下文中被回收时无法恢复上下文变量，
+残留的追踪会被之后的请求误用。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+# 追踪文件超过此大小时轮转为 .1 文件
+TRACE_FILE_MAX_BYTES = 50 * 1024 * 1024
+
+_current_trace = ContextVar("sdgen_trace", default=None)
+_current_span = ContextVar("sdgen_span", default=None)
+
+
+def _new_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+class Span:
+    """追踪中的一个阶段"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start", "duration", "attrs", "error")
+
+    def __init__(self, name: str, parent_id: str = None, attrs: dict = None):
+        self.name = name
+        self.span_id = _new_id()[:8]
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attrs = attrs or {}
+        self.error = None
+
+
+class Trace:
+    """一次请求的追踪
+
+    追踪ID始终生成，用于在日志中关联同一请求；只有被采样的追踪才会记录阶段并导出。
+    追踪可能被多个协程持有（例如异步任务模式下命令已返回而任务仍在执行），
+    所有持有者都释放后才结束并导出。
+    """
+
+    def __init__(self, tracer, name: str, sampled: bool, attrs: dict = None):
+        self.tracer = tracer
+        self.trace_id = _new_id()
+        self.name = name
+        self.sampled = sampled
+        self.attrs = attrs or {}
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self._holders = 1
+
+    def retain(self):
+        """增加一个持有者"""
+        self._holders += 1
+
+    def release(self):
+        """释放一个持有者，全部释放后结束追踪"""
+        self._holders -= 1
+        if self._holders == 0:
+            self.duration = time.perf_counter() - self.start
+            self.tracer.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "attrs": self.attrs,
+            "spans": [
+                {
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "offset": span.start - self.start,
+                    "duration": span.duration,
+                    "attrs": span.attrs,
+                    "error": span.error,
+                }
+                for span in self.spans
+            ],
+        }
+
+
+def current_trace():
+    """获取当前上下文中的追踪，没有时返回 None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace: Trace):
+    """将追踪设为当前上下文的追踪，trace 为 None 时不做任何事
+
+    只能在执行请求的独立任务中使用（任务拥有自己的上下文副本），不能包裹向调用方 yield 的代码。
+    """
+    if trace is None:
+        yield None
+        return
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, trace: Trace = None, **attrs):
+    """在当前追踪中记录一个阶段的耗时；没有被采样的追踪时不做任何事
+
+    显式传入 trace 时直接记录到该追踪（作为顶层阶段），不读取也不修改上下文变量，
+    可以用于包裹向调用方 yield 的代码。
+    """
+    explicit = trace is not None
+    trace = trace if explicit else _current_trace.get()
+    if trace is None or not trace.sampled:
+        yield None
+        return
+
+    if explicit:
+        current = Span(name, None, attrs)
+        trace.spans.append(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.error = type(e).__name__
+            raise
+        finally:
+            current.duration = time.perf_counter() - current.start
+        return
+
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else None, attrs)
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _reset(_current_span, token)
+
+
+def _reset(var: ContextVar, token):
+    """恢复上下文变量；异步生成器在其他上下文中被关闭时无法恢复，此时忽略"""
+    try:
+        var.reset(token)
+    except ValueError:
+        pass
+
+
+class Tracer:
+    """追踪器，负责创建追踪、按采样率决定是否记录，并将结束的追踪以JSONL格式导出"""
+
+    def __init__(self, config_manager, export_path: str = None):
+        self.config_manager = config_manager
+        self.export_path = export_path
+
+    def start(self, name: str, **attrs) -> Trace:
+        """开始一次追踪，调用方持有并负责 release；追踪不会被设为当前上下文的追踪"""
+        sample_rate = self.config_manager.get_trace_sample_rate()
+        sampled = bool(self.export_path) and sample_rate > 0 and random.random() < sample_rate
+        return Trace(self, name, sampled, attrs)
+
+    def export(self, trace: Trace):
+        """导出结束的追踪（仅被采样的追踪），在线程中追加写入"""
+        if not trace.sampled or not self.export_path:
+            return
+        line = json.dumps(trace.to_dict(), ensure_ascii=False) + "\n"
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._append(line)
+            return
+        loop.run_in_executor(None, self._append, line)
+
+    def _append(self, line: str):
+        try:
+            if os.path.exists(self.export_path) and os.path.getsize(self.export_path) > TRACE_FILE_MAX_BYTES:
+                os.replace(self.export_path, f"{self.export_path}.1")
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"写入追踪文件失败: {e}")
+
+
+class TraceLogFilter(logging.Filter):
+    """在日志消息前添加当前请求的追踪ID"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = _current_trace.get()
+        record.trace_id = trace.trace_id if trace is not None else "-"
+        if trace is not None and isinstance(record.msg, str) and not record.msg.startswith("[trace:"):
+            record.msg = f"[trace:{trace.trace_id}] {record.msg}"
+        return True
+
+
+def install_log_filter(package: str):
+    """为包内所有模块的日志记录器添加追踪ID过滤器（重复调用无副作用）"""
+    for name, item in list(logging.root.manager.loggerDict.items()):
+        if not isinstance(item, logging.Logger) or not (name == package or name.startswith(f"{package}.")):
+            continue
+        if not any(isinstance(existing, TraceLogFilter) for existing in item.filters):
+            item.addFilter(TraceLogFilter())